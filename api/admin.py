@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Product, Order, OrderItem
+from .models import User, Product, Order, OrderItem, Task
 
 
 # Register your models here.
@@ -11,8 +11,22 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         OrderItemInline
     ]
+    readonly_fields = ('total_price', 'item_count')
+    list_select_related = ('user',)                 # Order.__str__ shows the username: one JOIN, not one query per row
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.recalculate_totals()          # Items may be changed in the inline
 
 
 admin.site.register(Order, OrderAdmin)
 admin.site.register(User)
 admin.site.register(Product)
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'name')
+
+
+admin.site.register(Task, TaskAdmin)
@@ -0,0 +1,194 @@
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max
+from django.http import Http404
+
+from api.models import Product, Order
+from api.serializers import OrderSerializer
+from api.filters import OrderFilter
+from api.metrics import SerializerTimingMixin
+from api.pagination import KeysetPagination
+from api.cache import product_list_cache, product_detail_cache, product_info_cache
+from api.views import ProductListCreatAPIView, ProductDetailAPIView, ProductInfoAPIView
+
+from rest_framework import generics
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from django_filters.rest_framework import DjangoFilterBackend
+
+"""
+Async (ASGI) versions of the read endpoints, mounted under /api/async/.
+
+DRF views are sync. Under an ASGI server (uvicorn, daphne, ...) Django runs every sync view in a
+thread of a small pool, so a slow DB or cache round-trip keeps a thread busy and requests queue up.
+These views are native coroutines:
+    - Cache reads/writes use Django's async cache API (cache.aget / cache.aset). See api/cache.py
+    - The ORM is used through its async API (aget, aaggregate, async for ...)
+    - Authentication, permissions and throttling are the same DRF classes as the sync views. They run
+      once per request in one sync_to_async() call (JWT/session auth loads the user from the DB).
+The output is exactly the same as the sync endpoint's output.
+
+Notes:
+    - Django's async ORM still runs each query with sync_to_async() (DB drivers are sync), but the event
+      loop is free while it waits. A cache hit never leaves the event loop (with an async cache backend).
+    - Sync-only middleware (silk) makes Django adapt the whole chain back to sync (one thread per
+      request again). The views still work, but the benefit shows only without sync-only middleware.
+    - Compare both with: python manage.py benchmark_asgi
+"""
+
+
+class AsyncAPIViewMixin:
+    """
+    Add before a DRF APIView/GenericAPIView. Handlers (get, ...) must be `async def`.
+    Same flow as APIView.dispatch(), but the handler is awaited.
+    """
+    http_method_names = ['get', 'head', 'options']      # Read only
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Authentication (DB lookup for the user), permissions and throttles: all sync, one thread hop.
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):           # OPTIONS / 405 handlers are still sync
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+
+class AsyncProductListAPIView(AsyncAPIViewMixin, ProductListCreatAPIView):
+    """
+    GET /api/async/products/ (same filters, search, ordering and ?page_size= as /api/products/).
+    Shares the product_list cache entries with the sync view.
+    """
+    async def get(self, request, *args, **kwargs):
+        params = product_list_cache.get_params(request, self)     # No DB query (only validates the params)
+        if params is None:
+            return await self.get_list()                           # Invalid filters. 400 like the sync view.
+
+        key = await product_list_cache.amake_key(params)
+        data = await product_list_cache.aget(key)
+        if data is not None:
+            return Response(data)
+
+        response = await self.get_list()
+        await product_list_cache.aset(key, response.data)
+        return response
+
+    async def get_list(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        products = [product async for product in queryset]
+        return Response(self.get_serializer(products, many=True).data)
+
+
+class AsyncProductDetailAPIView(AsyncAPIViewMixin, ProductDetailAPIView):
+    """
+    GET /api/async/products/<pk>/
+    """
+    async def get(self, request, *args, **kwargs):
+        key = await product_detail_cache.amake_key([('pk', kwargs['pk'])])
+        data = await product_detail_cache.aget(key)
+        if data is None:
+            data = self.get_serializer(await self.aget_object()).data
+            await product_detail_cache.aset(key, data)
+        return Response(data)
+
+
+class AsyncProductInfoAPIView(AsyncAPIViewMixin, ProductInfoAPIView):
+    """
+    GET /api/async/products/info/
+    """
+    async def get(self, request):
+        products = await self.apaginate_queryset(self.get_queryset())
+        serializer = self.get_serializer({
+            'products': products,
+            **await self.aget_aggregates(),
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+        })
+        return Response(serializer.data)
+
+    async def aget_aggregates(self):
+        key = await product_info_cache.amake_key([])
+        aggregates = await product_info_cache.aget(key)
+        if aggregates is None:
+            aggregates = await Product.objects.aaggregate(count=Count('pk'), max_price=Max('price'))
+            await product_info_cache.aset(key, aggregates)
+        return aggregates
+
+
+class AsyncOrderMixin:
+    """
+    Same queryset, permissions, filters and pagination as OrderViewSet (list and retrieve).
+    """
+    throttle_scope = 'orders'
+    queryset = Order.objects.prefetch_related('items')      # Prefetched (with the product snapshot), so serializing never queries
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('created_at', 'order_id')
+    filterset_class = OrderFilter
+    filter_backends = [DjangoFilterBackend]
+    query_budget = {'get': 5}
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if not self.request.user.is_staff:
+            qs = qs.filter(user=self.request.user)
+        return qs
+
+
+class AsyncOrderListAPIView(SerializerTimingMixin, AsyncAPIViewMixin, AsyncOrderMixin, generics.GenericAPIView):
+    """
+    GET /api/async/orders/
+    """
+    async def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        orders = [order async for order in queryset]         # prefetch_related runs with it
+        return Response(self.get_serializer(orders, many=True).data)
+
+
+class AsyncOrderDetailAPIView(SerializerTimingMixin, AsyncAPIViewMixin, AsyncOrderMixin, generics.GenericAPIView):
+    """
+    GET /api/async/orders/<order_id>/
+    """
+    async def get(self, request, *args, **kwargs):
+        return Response(self.get_serializer(await self.aget_object()).data)
@@ -0,0 +1,142 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+"""
+JWT authentication without a User SELECT per request.
+
+simplejwt's JWTAuthentication decodes + verifies the token and then runs
+User.objects.get(pk=<user_id from the token>) on every request. Here two caches sit in front of that:
+
+    1. In this process: raw token -> (verified token, user). Bounded (JWT_LOCAL_CACHE_SIZE, least recently
+       used is dropped) and short lived (JWT_LOCAL_CACHE_TTL seconds, never longer than the token's 'exp').
+       A hit costs no signature check, no Redis call and no query.
+    2. The Django cache (Redis): 'jwt_user:<id>' -> a few fields of the user (CACHED_USER_FIELDS + a digest of the
+       password hash for the revoke check, never the hash itself), for JWT_USER_CACHE_TTL seconds. Shared by every
+       process, so a new token (or another worker) needs no query either. The user is rebuilt with
+       User.from_db(): the other fields are deferred (loaded by a query if a view reads them).
+
+Invalidation (api/signals.py): saving or deleting a User, or blacklisting one of its tokens (when the
+'rest_framework_simplejwt.token_blacklist' app is installed), deletes its 'jwt_user' entry and its tokens
+in this process, right away and again after commit. Other processes keep their local entries until
+JWT_LOCAL_CACHE_TTL runs out, so e.g. a deactivated user is refused everywhere after at most that many seconds.
+
+Every request gets its own copy of the cached user: views can change request.user without changing the cache.
+"""
+
+
+CACHED_USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+    return f'jwt_user:{user_id}'
+
+
+def user_snapshot(user):
+    snapshot = {name: getattr(user, name) for name in CACHED_USER_FIELDS}
+    snapshot['password_digest'] = get_md5_hash_password(user.password)
+    return snapshot
+
+
+def user_from_snapshot(model, snapshot):
+    # from_db() wants the values in the model's field order
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in snapshot]
+    user = model.from_db(model.objects.db, names, [snapshot[name] for name in names])
+    return user, snapshot['password_digest']
+
+
+class LocalTTLCache:
+    """
+    Thread safe LRU dict whose entries also expire. Entries belong to an owner (user id) for invalidation.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()           # key -> (value, owner, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, owner, expires_at):
+        max_size = getattr(settings, 'JWT_LOCAL_CACHE_SIZE', 1024)
+        with self._lock:
+            self._entries[key] = (value, owner, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def discard_owner(self, owner):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] == owner]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_tokens = LocalTTLCache()
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+    local_tokens.discard_owner(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        cached = local_tokens.get(raw_token)
+        if cached is not None:
+            user, validated_token = cached
+            return copy.copy(user), validated_token
+
+        validated_token = self.get_validated_token(raw_token)       # Signature, expiry, blacklist
+        user = self.get_user(validated_token)
+
+        local_ttl = getattr(settings, 'JWT_LOCAL_CACHE_TTL', 10)
+        if local_ttl:
+            expires_at = min(time.time() + local_ttl, validated_token['exp'])
+            local_tokens.set(raw_token, (user, validated_token), user.pk, expires_at)
+        return copy.copy(user), validated_token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        key = user_cache_key(user_id)
+        snapshot = cache.get(key) if user_id is not None else None
+        if snapshot is None:
+            user = super().get_user(validated_token)                # Query + checks (active, revoked)
+            cache.set(key, user_snapshot(user), getattr(settings, 'JWT_USER_CACHE_TTL', 300))
+            return user
+
+        # Same checks as JWTAuthentication.get_user() on the cached user
+        user, password_digest = user_from_snapshot(self.user_model, snapshot)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
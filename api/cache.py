@@ -0,0 +1,215 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django_filters.rest_framework import DjangoFilterBackend
+
+from rest_framework import filters
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+"""
+Query level cache for list endpoints.
+
+cache_page() stores the whole HTTP response and keys it on the raw URL, so
+'?price__gt=10&name=tv', '?name=tv&price__gt=10' and '?price__gt=10.00&name=tv' are 3 cold misses
+for the same rows. Here the key is built from the *cleaned* filter values instead:
+    - FilterSet (django-filter)  -> form cleaned_data  (10 and 10.00 give the same key)
+    - SearchFilter               -> split search terms
+    - OrderingFilter             -> validated ordering
+    - Pagination                 -> cursor / page size
+and the value is the compact JSON of the serialized data, not a rendered page.
+
+Invalidation is done with a version (generation) number instead of deleting keys.
+Every key contains the current version, e.g. 'product_list:v42:<hash>'. A Product write only bumps
+the version to 43 (one INCR, O(1) no matter how many keys are cached), so readers start using new keys
+and the v42 entries are never read again and expire by their TTL.
+
+The order list uses one version per user ('order_version:<user id>') and the user id in the key:
+an order write only makes its owner's lists cold, and a refreshed JWT still hits the same entries
+(cache_page keyed them on the Authorization header).
+
+Every read method has an async twin (aget, amake_key, aset) built on Django's async cache API
+(cache.aget / cache.aset) for the async views in api/async_views.py.
+"""
+
+
+class CacheVersion:
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        version = cache.get(self.key)
+        if version is None:
+            # Start from a timestamp, not 1. If Redis evicts this key, a restart from 1 could
+            # match old entries that are still alive. The new value is always bigger than the old one.
+            cache.add(self.key, time.time_ns(), timeout=None)
+            version = cache.get(self.key)
+        return version
+
+    async def aget(self):
+        version = await cache.aget(self.key)
+        if version is None:
+            await cache.aadd(self.key, time.time_ns(), timeout=None)
+            version = await cache.aget(self.key)
+        return version
+
+    def bump(self):
+        try:
+            return cache.incr(self.key)
+        except ValueError:                  # Key does not exist (first write or evicted)
+            self.get()
+            return cache.incr(self.key)
+
+
+class QueryCache:
+    def __init__(self, prefix, timeout, version=None):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.version = version
+        # Counters are per process (like every worker's own metrics). Reading them never hits Redis.
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def get_params(self, request, view):
+        """
+        Return the normalized params as a sorted list of (name, value),
+        or None when the request can't be cached (e.g. invalid filter values).
+        """
+        queryset = view.get_queryset()
+        params = {}
+
+        for backend_class in view.filter_backends:
+            backend = backend_class()
+
+            if isinstance(backend, DjangoFilterBackend):
+                filterset = backend.get_filterset(request, queryset, view)
+                if filterset is None:
+                    continue
+                if not filterset.is_valid():
+                    return None             # Let the view raise the proper 400 error
+                for name, value in filterset.form.cleaned_data.items():
+                    if value not in (None, '', []):
+                        params[name] = self._normalize(value)
+
+            elif isinstance(backend, filters.SearchFilter):
+                terms = backend.get_search_terms(request)
+                if terms:
+                    params[backend.search_param] = ' '.join(terms)
+
+            elif isinstance(backend, filters.OrderingFilter):
+                ordering = backend.get_ordering(request, queryset, view)
+                if ordering:
+                    params[backend.ordering_param] = ','.join(ordering)
+
+        paginator = view.paginator
+        if paginator is not None:
+            for param in ('cursor_query_param', 'page_size_query_param', 'limit_query_param',
+                          'offset_query_param', 'page_query_param'):
+                name = getattr(paginator, param, None)
+                if name and name in request.query_params:
+                    params[name] = request.query_params[name]
+                    # Pages carry absolute next/previous links, so they also depend on the URL they were built for.
+                    params['_url'] = request.build_absolute_uri(request.path)
+
+        return sorted(params.items())
+
+    def make_key(self, params, version=None):
+        # `version` overrides the cache's own version, e.g. a per-user version (see user_order_version)
+        version = version or self.version
+        if version is None:
+            return self._build_key(params, None)
+        return self._build_key(params, version.get())
+
+    async def amake_key(self, params, version=None):
+        version = version or self.version
+        if version is None:
+            return self._build_key(params, None)
+        return self._build_key(params, await version.aget())
+
+    def _build_key(self, params, version):
+        digest = hashlib.md5(urlencode(params).encode(), usedforsecurity=False).hexdigest()
+        if version is None:
+            return f'{self.prefix}:{digest}'
+        return f'{self.prefix}:v{version}:{digest}'
+
+    def get(self, key):
+        return self._load(cache.get(key))
+
+    async def aget(self, key):
+        return self._load(await cache.aget(key))
+
+    def _load(self, payload):
+        with self._lock:
+            self._stats['hits' if payload is not None else 'misses'] += 1
+        if payload is None:
+            return None
+        return json.loads(payload)
+
+    def set(self, key, data):
+        # JSONRenderer output is compact (no spaces) and already has Decimal/UUID/datetime as strings.
+        cache.set(key, JSONRenderer().render(data), self.timeout)
+
+    async def aset(self, key, data):
+        await cache.aset(key, JSONRenderer().render(data), self.timeout)
+
+    def get_response(self, key, get_response):
+        """
+        Read-through: return the cached data, or call get_response() (the normal DRF view) and cache its data.
+        """
+        data = self.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = get_response()
+        self.set(key, response.data)
+        return response
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self._stats['hits'], self._stats['misses']
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+
+    @classmethod
+    def _normalize(cls, value):
+        if isinstance(value, slice):            # RangeFilter
+            return f'{cls._normalize(value.start)},{cls._normalize(value.stop)}'
+        if isinstance(value, (list, tuple)):    # BaseRangeFilter / BaseInFilter
+            return ','.join(cls._normalize(item) for item in value)
+        if isinstance(value, Decimal):
+            return str(value.normalize())       # 10, 10.0 and 10.00 -> same key
+        return str(value)
+
+
+product_version = CacheVersion('product_version')          # Bumped by Product save/delete. See api/signals.py
+
+product_list_cache = QueryCache('product_list', timeout=60 * 60 * 2, version=product_version)      # 2 Hour
+product_detail_cache = QueryCache('product_detail', timeout=60 * 60 * 2, version=product_version)
+product_info_cache = QueryCache('product_info', timeout=60 * 60 * 2, version=product_version)
+
+# Orders: one version per user, so a write only makes that user's lists cold, plus one for all orders (staff lists).
+# Bumped by Order / OrderItem save/delete. See api/signals.py
+order_version = CacheVersion('order_version')
+
+
+def user_order_version(user_id):
+    return CacheVersion(f'order_version:{user_id}')
+
+
+def bump_order_versions(user_ids):
+    order_version.bump()
+    for user_id in user_ids:
+        user_order_version(user_id).bump()
+
+
+order_list_cache = QueryCache('order_list', timeout=60 * 15)        # 15 Minutes. Keys are per user, see OrderViewSet.list
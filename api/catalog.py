@@ -0,0 +1,124 @@
+import csv
+import json
+import time
+
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.utils import encoders
+
+from api.models import Product
+from api.serializers import ProductSerializer
+
+"""
+Reading / writing the product catalog as CSV or NDJSON (used by import_products and export_products).
+
+Files are read and written one row at a time (csv module / one JSON object per line),
+so memory does not depend on the file size.
+
+Columns: sku, name, description, price, stock
+'sku' is the key: importing a row with a known sku updates that product, otherwise a new product is created.
+Products without a sku are exported with an empty sku (import_products reports those rows as invalid).
+"""
+
+FIELDS = ('sku', 'name', 'description', 'price', 'stock')
+FORMATS = ('csv', 'ndjson')
+
+
+def guess_format(path, file_format=None):
+    if file_format:
+        return file_format
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(file, file_format):
+    """
+    Yields (line number, dict) pairs.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = {'__error__': f'Invalid JSON: {exc}'}
+            yield line_number, row
+
+
+class RowWriter:
+    def __init__(self, file, file_format):
+        self.file = file
+        self.file_format = file_format
+        if file_format == 'csv':
+            self.writer = csv.writer(file)
+            self.writer.writerow(FIELDS)
+
+    def write(self, values):
+        if self.file_format == 'csv':
+            self.writer.writerow(values)
+        else:
+            self.file.write(json.dumps(dict(zip(FIELDS, values)), cls=encoders.JSONEncoder, ensure_ascii=False) + '\n')
+
+
+class ProductRowValidator:
+    """
+    Same checks as POST /api/products/: every ProductSerializer field + its validate_<field>()
+    (e.g. validate_price: price must be > 0). The serializer is built once, not once per row.
+    """
+    sku_field = serializers.CharField(max_length=Product._meta.get_field('sku').max_length)
+
+    def __init__(self):
+        self.serializer = ProductSerializer()
+        self.fields = [(name, field) for name, field in self.serializer.fields.items() if not field.read_only]
+
+    def validate(self, row):
+        """
+        Returns (data, errors). Mirrors Serializer.to_internal_value().
+        """
+        if not isinstance(row, dict):               # Valid JSON but not an object: 5, null, [...]
+            return None, {'row': ['Expected an object.']}
+        if '__error__' in row:
+            return None, {'row': [row['__error__']]}
+
+        data = {}
+        errors = {}
+        for name, field in [('sku', self.sku_field), *self.fields]:
+            try:
+                value = field.run_validation(row.get(name, empty))
+                validate_method = getattr(self.serializer, f'validate_{name}', None)
+                if validate_method is not None:
+                    value = validate_method(value)
+                data[name] = value
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+        return data, errors
+
+
+class Progress:
+    """
+    Prints "<count> <unit> (<rate>/s)" at most once per `interval` seconds, and a summary at the end.
+    """
+    def __init__(self, stream, unit='rows', interval=1.0):
+        self.stream = stream
+        self.unit = unit
+        self.interval = interval
+        self.count = 0
+        self.start = self.last = time.perf_counter()
+
+    def update(self, count):
+        self.count += count
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.stream.write(self.format())
+
+    def format(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed else 0
+        return f'{self.count} {self.unit} in {elapsed:.1f}s ({rate:.0f} {self.unit}/s)'
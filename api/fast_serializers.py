@@ -0,0 +1,232 @@
+import decimal
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from api.serializers import ProductSerializer, OrderItemSerializer, OrderSerializer
+
+"""
+Fast read-only serializers (opt-in with FAST_READ_SERIALIZERS = True in settings).
+
+A ModelSerializer creates a model instance per row, then for every field of every row it calls
+get_attribute() + to_representation() (and Decimal quantize with a new context each time).
+On list endpoints that is most of the CPU time.
+
+A FastReadSerializer is "compiled" once from a ModelSerializer:
+    - every field becomes a values_list() lookup ('product.name' -> 'product__name') + a small converter
+    - nested many=True serializers are loaded with ONE extra values_list() query and grouped in Python
+    - fields that are not DB columns (properties, SerializerMethodField) must be declared in `computed`
+Then rows are plain tuples from the DB. The output is exactly the same as the ModelSerializer output
+(same keys, same order, same strings), only faster. See `python manage.py benchmark_serializers`.
+"""
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+
+    # Same quantize as DecimalField.quantize(), but the exponent and context are built once
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if value is None:
+            return ''
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != 'iso-8601' or getattr(field, 'timezone', None) is not None:
+        return field.to_representation
+
+    def convert(value):
+        if value is None:
+            return None
+        if timezone.is_aware(value):
+            value = value.astimezone(timezone.get_current_timezone())
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _uuid_converter(field):
+    if field.uuid_format != 'hex_verbose':
+        return field.to_representation
+    return lambda value: None if value is None else str(value)
+
+
+def get_converter(field):
+    if isinstance(field, serializers.DecimalField):
+        return _decimal_converter(field)
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, serializers.UUIDField):
+        return _uuid_converter(field)
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return _identity                # values_list('user') already gives the pk
+    if isinstance(field, (serializers.ChoiceField, serializers.IntegerField)):
+        return _identity
+    if type(field) is serializers.CharField:
+        return _identity
+    return field.to_representation     # Anything else: still correct, just not faster
+
+
+class FastReadSerializer:
+    """
+    Subclasses set:
+        serializer_class = the ModelSerializer whose output is reproduced
+        computed = {'field': (('lookup', ...), function(*values))}   for non-column fields
+        nested = {'field': (FastReadSerializer subclass, 'fk lookup to the parent')}
+    """
+    serializer_class = None
+    computed = {}
+    nested = {}
+
+    def __init__(self, instance=None, many=True, **kwargs):
+        self.instance = instance
+        self.context = kwargs.get('context', {})
+
+    @classmethod
+    def can_serialize(cls, instance):
+        # Works on querysets only. Pages / lists of instances use the normal serializer.
+        return hasattr(instance, 'values_list')
+
+    @classmethod
+    def compile(cls):
+        if '_compiled' in cls.__dict__:
+            return cls._compiled
+
+        lookups = []
+        plan = []           # (name, kind, value) where kind is 'field', 'computed' or 'nested'
+
+        def lookup_index(lookup):
+            if lookup not in lookups:
+                lookups.append(lookup)
+            return lookups.index(lookup)
+
+        for name, field in cls.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in cls.computed:
+                field_lookups, function = cls.computed[name]
+                plan.append((name, 'computed', ([lookup_index(lookup) for lookup in field_lookups], function)))
+            elif name in cls.nested:
+                plan.append((name, 'nested', cls.nested[name]))
+            elif isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+                raise ImproperlyConfigured(f'{cls.__name__}: declare "{name}" in computed or nested.')
+            else:
+                lookup = field.source.replace('.', '__')
+                plan.append((name, 'field', (lookup_index(lookup), get_converter(field))))
+
+        cls._compiled = (lookups, plan)
+        return cls._compiled
+
+    def rows(self, queryset, extra_lookups=()):
+        lookups, _ = self.compile()
+        # The queryset ordering (e.g. ?ordering=price) is kept. Prefetches are not needed with values_list().
+        return queryset.prefetch_related(None).values_list(*lookups, *extra_lookups)
+
+    def to_representation(self, queryset, extra_lookups=()):
+        """
+        Returns (row, output dict) pairs. 'row' is kept so callers can read the extra lookups.
+        """
+        lookups, plan = self.compile()
+        rows = list(self.rows(queryset, ('pk', *extra_lookups)))
+        pk_index = len(lookups)
+
+        children = {}
+        for name, kind, value in plan:
+            if kind == 'nested':
+                child_class, parent_lookup = value
+                children[name] = child_class().group_by_parent(queryset, parent_lookup)
+
+        output = []
+        for row in rows:
+            data = {}
+            for name, kind, value in plan:
+                if kind == 'field':
+                    index, convert = value
+                    data[name] = convert(row[index])
+                elif kind == 'computed':
+                    indexes, function = value
+                    data[name] = function(*(row[index] for index in indexes))
+                else:
+                    data[name] = children[name].get(row[pk_index], [])
+            output.append((row, data))
+        return output
+
+    def group_by_parent(self, parent_queryset, parent_lookup):
+        model = self.serializer_class.Meta.model
+        # Parents as a subquery: one query for all children, no giant IN (...) list.
+        queryset = model.objects.filter(**{f'{parent_lookup}__in': parent_queryset.order_by().values('pk')}).order_by('pk')
+
+        grouped = defaultdict(list)
+        parent_index = len(self.compile()[0]) + 1          # after the lookups and 'pk'
+        for row, data in self.to_representation(queryset, (parent_lookup,)):
+            grouped[row[parent_index]].append(data)
+        return grouped
+
+    @property
+    def data(self):
+        return ReturnList([data for _, data in self.to_representation(self.instance)], serializer=self)
+
+
+class FastProductSerializer(FastReadSerializer):
+    serializer_class = ProductSerializer
+
+
+class FastOrderItemSerializer(FastReadSerializer):
+    serializer_class = OrderItemSerializer
+    computed = {
+        'item_subtotal': (('unit_price', 'quantity'), lambda price, quantity: price * quantity),    # OrderItem.item_subtotal
+    }
+
+
+class FastOrderSerializer(FastReadSerializer):
+    serializer_class = OrderSerializer
+    computed = {
+        'total_price': (('total_price',), _identity),          # OrderSerializer.get_total_price
+    }
+    nested = {
+        'items': (FastOrderItemSerializer, 'order'),
+    }
+
+
+class FastReadMixin:
+    """
+    View mixin. With FAST_READ_SERIALIZERS = True, GET requests that serialize a whole queryset
+    with `serializer_class` use `fast_serializer_class` instead.
+    """
+    fast_serializer_class = None
+
+    def get_serializer(self, *args, **kwargs):
+        fast_serializer_class = self.fast_serializer_class
+        if (
+            getattr(settings, 'FAST_READ_SERIALIZERS', False)
+            and fast_serializer_class is not None
+            and self.request.method == 'GET'
+            and kwargs.get('many')
+            and args and fast_serializer_class.can_serialize(args[0])
+            and self.get_serializer_class() is fast_serializer_class.serializer_class
+        ):
+            kwargs.setdefault('context', self.get_serializer_context())
+            return fast_serializer_class(*args, **kwargs)
+        return super().get_serializer(*args, **kwargs)
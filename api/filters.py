@@ -1,4 +1,7 @@
+import datetime
+
 import django_filters
+from django.utils import timezone
 
 from api.models import Product, Order
 
@@ -14,7 +17,16 @@ class ProductFilter(django_filters.FilterSet):
 
 
 class OrderFilter(django_filters.FilterSet):
-    created_at = django_filters.DateFilter(field_name='created_at__date')   # Extracts the date part from the DateTimeField and Ignores time (HH:MM:SS)
+    # created_at = django_filters.DateFilter(field_name='created_at__date')   # Extracts the date part from the DateTimeField and Ignores time (HH:MM:SS)
+    # 'created_at__date' runs a function on every row (DATE(created_at) = ?) so the DB can't use an index on created_at.
+    # The same day as a datetime range (created_at >= 00:00 AND created_at < next day 00:00) can use the index.
+    created_at = django_filters.DateFilter(method='filter_created_at_date')
+
+    def filter_created_at_date(self, queryset, name, value):
+        start = timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))     # Midnight in current timezone
+        end = timezone.make_aware(datetime.datetime.combine(value + datetime.timedelta(days=1), datetime.time.min))
+        return queryset.filter(**{f'{name}__gte': start, f'{name}__lt': end})
+
     class Meta:
         model = Order
         fields = {
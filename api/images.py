@@ -0,0 +1,132 @@
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from api.cache import product_version
+from api.models import Product
+from api.tasks import task
+
+"""
+Product image renditions (resized copies of Product.image).
+
+Clients don't need a 3000px original for a 200px catalog tile. When a product gets a new image
+(Product post_save signal, api/signals.py) the background worker (api/tasks.py) writes one file per
+size in PRODUCT_IMAGE_SIZES and format in PRODUCT_IMAGE_FORMATS (WebP, and JPEG for clients without WebP):
+    - resized to fit in size x size (aspect ratio kept, never enlarged), EXIF rotation applied, metadata dropped
+    - the names come from a hash of the original's bytes + size + quality:
+          renditions/3f/3fa9...-200-q80.webp
+      The same original uploaded twice gives the same files (nothing encoded again), and a changed image gives
+      new URLs: they can be cached forever by the browser / CDN.
+    - stored on Product.image_renditions; ProductSerializer's 'images' shows them as URLs (MEDIA_URL, e.g. a CDN)
+After changing the sizes / formats / quality: python manage.py generate_image_renditions --all
+Files of replaced images are not deleted (another product can use the same ones).
+"""
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def get_sizes():
+    return getattr(settings, 'PRODUCT_IMAGE_SIZES', {'thumb': 200, 'medium': 600})
+
+
+def get_formats():
+    return getattr(settings, 'PRODUCT_IMAGE_FORMATS', ('webp', 'jpeg'))
+
+
+def get_quality():
+    return getattr(settings, 'PRODUCT_IMAGE_QUALITY', 80)
+
+
+def rendition_name(source_hash, size, file_format, quality):
+    return f'renditions/{source_hash[:2]}/{source_hash[:32]}-{size}-q{quality}.{file_format}'
+
+
+def to_rgb(image):
+    # JPEG has no transparency: transparent pixels become white
+    if image.mode == 'RGB':
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode(image, file_format, quality):
+    buffer = BytesIO()
+    if file_format == 'jpeg':
+        to_rgb(image).save(buffer, FORMATS[file_format], quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, FORMATS[file_format], quality=quality, method=4)     # method: 0 fast ... 6 smallest
+    return buffer.getvalue()
+
+
+def make_renditions(image_file, storage=default_storage):
+    """
+    Writes the missing rendition files of one image.
+    Returns {'thumb': {'width': 200, 'height': 150, 'webp': <storage name>, 'jpeg': <storage name>}, ...}
+    """
+    with image_file.open('rb') as file:
+        data = file.read()
+    source_hash = hashlib.sha256(data).hexdigest()
+    quality = get_quality()
+
+    with Image.open(BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in original.mode or 'transparency' in original.info
+            original = original.convert('RGBA' if has_alpha else 'RGB')
+
+        renditions = {}
+        for name, size in get_sizes().items():
+            image = original.copy()
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            rendition = {'width': image.width, 'height': image.height}
+            for file_format in get_formats():
+                path = rendition_name(source_hash, size, file_format, quality)
+                if not storage.exists(path):
+                    path = storage.save(path, ContentFile(encode(image, file_format, quality)))
+                rendition[file_format] = path
+            renditions[name] = rendition
+    return renditions
+
+
+def needs_renditions(product):
+    # The renditions were made from another image (or none yet)
+    return (product.image.name or '') != product.image_renditions.get('source', '')
+
+
+@task
+def generate_renditions(product_id):
+    """
+    Background task: (re)makes the renditions of a product's current image. No image: no renditions.
+    """
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return
+    source = product.image.name or ''
+    renditions = make_renditions(product.image) if source else {}
+
+    # update(), not save(): no signals (they would enqueue this again). Only stored if the image is still the same,
+    # a newer image has its own task.
+    same_image = Q(image=source) if source else Q(image='') | Q(image__isnull=True)
+    updated = Product.objects.filter(same_image, pk=product_id).update(
+        image_renditions={'source': source, 'renditions': renditions}, updated_at=Now(),
+    )
+    if updated:
+        product_version.bump()                  # Cached product responses show the new URLs
+
+
+def rendition_urls(image_renditions, storage=default_storage):
+    renditions = {}
+    for name, rendition in image_renditions.get('renditions', {}).items():
+        renditions[name] = {
+            key: storage.url(value) if key in FORMATS else value
+            for key, value in rendition.items()
+        }
+    return renditions
@@ -0,0 +1,52 @@
+# This script fills Order.total_price / Order.item_count for existing orders (created before these fields existed).
+
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import bump_order_versions
+from api.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the precomputed total_price and item_count of every order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Totals are computed by the DB (SUM/COUNT with GROUP BY), one query per batch. Not per order.
+        orders = (
+            Order.objects
+            .order_by('pk')
+            .annotate(**Order.totals_annotation())
+            .only('pk', 'user', 'total_price', 'item_count')
+        )
+
+        updated = 0
+        batch = []
+        now = timezone.now()
+        for order in orders.iterator(chunk_size=batch_size):
+            order.total_price = order.computed_total_price or 0
+            order.item_count = order.computed_item_count
+            order.updated_at = now                  # bulk_update() doesn't set auto_now fields
+            batch.append(order)
+
+            if len(batch) >= batch_size:
+                updated += self.save_batch(batch)
+                batch = []
+
+        if batch:
+            updated += self.save_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated totals of {updated} orders'))
+
+    def save_batch(self, batch):
+        with transaction.atomic():
+            Order.objects.bulk_update(batch, ['total_price', 'item_count', 'updated_at'])
+            # bulk_update() sends no signals: the owners' cached order lists are made stale here, once committed
+            transaction.on_commit(partial(bump_order_versions, {order.user_id for order in batch}))
+        return len(batch)
@@ -0,0 +1,303 @@
+# This script benchmarks the API endpoints and saves the numbers as JSON, so two versions can be compared.
+# The requests come from api/benchmark_requests.jsonl (one request per line, $product_id / $order_id are filled
+# from the DB) and optionally from an .http file like api.http (--http-file api.http, its tokens are replaced).
+# Every request is sent with a JWT of --username (anonymous users are throttled to 2 requests/minute).
+#
+# Targets:
+#   --target client (default)        django.test.Client in this process. Also counts the DB queries per request.
+#                                    Runs inside a transaction that is rolled back: order_create leaves nothing behind.
+#                                    Throttling is off (every DEFAULT_THROTTLE_RATES scope set to None for the run):
+#                                    the numbers are about the views, not the rate limits.
+#   --target http://localhost:8000   a running server (runserver, gunicorn, uvicorn ...). Writes are real!
+#                                    Queries are read from its X-DB-Queries header (QUERY_BUDGET_MODE and QUERY_BUDGET_HEADER on).
+#                                    Its throttle rates apply: raise them in its settings (429s are counted as errors).
+#
+# Examples:
+#   python manage.py generate_data --orders 100000
+#   python manage.py benchmark_api --requests 200 --output before.json
+#   python manage.py benchmark_api --requests 200 --output after.json --compare before.json
+
+import datetime
+import http.client
+import json
+import logging
+import statistics
+import string
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import User, Product, Order
+from api.query_budget import QUERY_COUNT_HEADER, is_counted
+
+DEFAULT_REQUESTS_FILE = Path(__file__).resolve().parents[2] / 'benchmark_requests.jsonl'
+
+
+def load_requests(path, values):
+    scenarios = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                # $placeholders are replaced in the raw line, so they also work for numbers in the body
+                scenarios.append(json.loads(string.Template(line).substitute(values)))
+    return scenarios
+
+
+def load_http_file(path):
+    """
+    Reads the requests of a VS Code REST Client / JetBrains .http file ('###' between requests).
+    """
+    scenarios = []
+    blocks = Path(path).read_text(encoding='utf-8').split('###')
+    for block in blocks:
+        lines = block.strip().splitlines()
+        if not lines:
+            continue
+        method, url = lines[0].split()[:2]
+        split = urlsplit(url)
+        path = split.path + (f'?{split.query}' if split.query else '')
+
+        # Headers (Authorization, Content-Type) are not needed: every request gets a fresh token and is JSON
+        body_start = next((index for index, line in enumerate(lines) if not line.strip()), len(lines))
+        body = '\n'.join(lines[body_start:]).strip()
+
+        scenarios.append({
+            'name': f'{method} {path}',
+            'method': method,
+            'path': path,
+            'body': json.loads(body) if body else None,
+        })
+    return scenarios
+
+
+def count_queries(queries):
+    return sum(1 for query in queries if is_counted(query['sql']))
+
+
+class ClientTarget:
+    name = 'client'
+
+    def __init__(self, token):
+        self.client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def request(self, scenario):
+        reset_queries()                     # The query log keeps only the last 9000 queries
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.generic(
+                scenario['method'], scenario['path'],
+                json.dumps(scenario['body']) if scenario.get('body') is not None else '',
+                content_type='application/json',
+            )
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        return response.status_code, count_queries(queries)
+
+
+class LiveTarget:
+    def __init__(self, url, token):
+        split = urlsplit(url)
+        self.name = url
+        self.host, self.port = split.hostname, split.port
+        self.connection_class = http.client.HTTPSConnection if split.scheme == 'https' else http.client.HTTPConnection
+        self.token = token
+        self.local = threading.local()
+
+    def request(self, scenario):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = self.connection_class(self.host, self.port, timeout=60)    # Keep-alive per thread
+
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'}
+        body = json.dumps(scenario['body']) if scenario.get('body') is not None else None
+
+        try:
+            self.local.connection.request(scenario['method'], scenario['path'], body=body, headers=headers)
+            response = self.local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.local.connection.close()
+            del self.local.connection
+            return 599, None                # Connection error
+        # Counted by the server's QueryBudgetMiddleware (None when QUERY_BUDGET_MODE is off). See api/query_budget.py
+        queries = response.getheader(QUERY_COUNT_HEADER)
+        return response.status, int(queries) if queries is not None else None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the API endpoints: throughput, p50/p95/p99 latency and DB queries per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='client', help="'client' (in-process) or the URL of a running server")
+        parser.add_argument('--requests-file', default=str(DEFAULT_REQUESTS_FILE))
+        parser.add_argument('--http-file', help='Also replay the requests of this .http file (e.g. api.http)')
+        parser.add_argument('--only', nargs='*', help='Only these request names')
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Not measured requests per endpoint (caches, connections)')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests (live server only)')
+        parser.add_argument('--username', help="Default: the first 'loadtest_' user of generate_data, else 'admin'")
+        parser.add_argument('--output', help='Save the results to this JSON file')
+        parser.add_argument('--compare', help='Compare with a saved JSON file. Fails on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 / throughput change for --compare (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        values = self.get_values(user)
+        token = str(RefreshToken.for_user(user).access_token)
+
+        scenarios = load_requests(options['requests_file'], values)
+        if options['http_file']:
+            scenarios += load_http_file(options['http_file'])
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios if scenario['name'] in options['only']]
+
+        if options['target'] == 'client':
+            if options['concurrency'] > 1:
+                raise CommandError('--concurrency needs a live server target (the client runs in one transaction)')
+            try:
+                setup_test_environment()        # Allows the 'testserver' host of the test client
+                test_environment = True
+            except RuntimeError:                # Already set up (e.g. when run from the tests)
+                test_environment = False
+            request_logger = logging.getLogger('django.request')
+            request_logger_level = request_logger.level
+            request_logger.setLevel(logging.ERROR)          # No "Not Found: ..." line per 4xx response
+            # Every scope to None (= not throttled). The throttles in api/throttles.py read the rates per request
+            rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+            unthrottled = override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': dict.fromkeys(rates)})
+            try:
+                with unthrottled, transaction.atomic():
+                    results = self.run(ClientTarget(token), scenarios, options)
+                    transaction.set_rollback(True)      # Don't keep created orders / reserved stock
+            finally:
+                request_logger.setLevel(request_logger_level)
+                if test_environment:
+                    teardown_test_environment()
+            target = 'client'
+        else:
+            results = self.run(LiveTarget(options['target'], token), scenarios, options)
+            target = options['target']
+
+        report = {
+            'meta': {
+                'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'git_commit': self.git_commit(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'target': target,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'username': user.username,
+            },
+            'results': results,
+        }
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2), encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f'Saved {options["output"]}'))
+
+        if options['compare']:
+            self.compare(json.loads(Path(options['compare']).read_text(encoding='utf-8')), report, options['threshold'])
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = (User.objects.filter(username__startswith='loadtest_').order_by('username').first()
+                    or User.objects.filter(username='admin').first())
+        if user is None:
+            raise CommandError('User not found. Run: python manage.py generate_data (or populate_db)')
+        return user
+
+    def get_values(self, user):
+        product = Product.objects.order_by('-stock', 'pk').first()             # Most stock: order_create won't run out
+        order = Order.objects.filter(user=user).order_by('-created_at').first()
+        if product is None or order is None:
+            raise CommandError(f'Needs products and an order of "{user.username}". Run: python manage.py generate_data')
+        return {'product_id': product.pk, 'order_id': order.pk, 'username': user.username}
+
+    def run(self, target, scenarios, options):
+        results = {}
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            # Concurrency 1 runs in this thread: same DB connection (and transaction) as the caller.
+            mapper = map if options['concurrency'] == 1 else pool.map
+            for scenario in scenarios:
+                for _ in range(options['warmup']):
+                    target.request(scenario)
+
+                def timed_request(_):
+                    start = time.perf_counter()
+                    status_code, queries = target.request(scenario)
+                    return time.perf_counter() - start, status_code, queries
+
+                start = time.perf_counter()
+                samples = list(mapper(timed_request, range(options['requests'])))
+                elapsed = time.perf_counter() - start
+
+                results[scenario['name']] = result = self.summarize(samples, elapsed)
+                self.stdout.write(self.format_result(scenario['name'], result))
+        return results
+
+    def summarize(self, samples, elapsed):
+        latencies = [latency * 1000 for latency, _, _ in samples]
+        queries = [count for _, _, count in samples if count is not None]
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, status_code, _ in samples if status_code >= 400),
+            'status_codes': sorted({status_code for _, status_code, _ in samples}),
+            'throughput': len(samples) / elapsed,
+            'mean_ms': statistics.fmean(latencies),
+            'p50_ms': percentiles[49],
+            'p95_ms': percentiles[94],
+            'p99_ms': percentiles[98],
+            'queries': statistics.median(queries) if queries else None,
+            'max_queries': max(queries) if queries else None,
+        }
+
+    def format_result(self, name, result):
+        queries = '-' if result['queries'] is None else f'{result["queries"]:g} (max {result["max_queries"]})'
+        return (
+            f'{name:<28} {result["throughput"]:8.1f} req/s  p50 {result["p50_ms"]:7.1f} ms  '
+            f'p95 {result["p95_ms"]:7.1f} ms  p99 {result["p99_ms"]:7.1f} ms  queries {queries}  '
+            f'errors {result["errors"]} {result["status_codes"]}'
+        )
+
+    def compare(self, baseline, report, threshold):
+        regressions = []
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            checks = [
+                ('p95_ms', result['p95_ms'] > before['p95_ms'] * (1 + threshold)),
+                ('throughput', result['throughput'] < before['throughput'] * (1 - threshold)),
+                ('queries', None not in (result['queries'], before['queries']) and result['queries'] > before['queries']),
+                ('errors', result['errors'] > before['errors']),
+            ]
+            for metric, regressed in checks:
+                if regressed:
+                    regressions.append(f'{name}: {metric} {before[metric]:g} -> {result[metric]:g}')
+
+        self.stdout.write(f'Compared with {baseline["meta"].get("git_commit")} ({baseline["meta"].get("created_at")})')
+        if regressions:
+            raise CommandError('Regressions:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,99 @@
+# This script compares the sync (WSGI) endpoints with their async (ASGI) versions (api/async_views.py).
+# It runs in-process: WSGI requests go through django.test.Client from a pool of threads (like a threaded
+# WSGI server), ASGI requests go through django.test.AsyncClient as concurrent tasks on one event loop.
+# No HTTP server and network in between, so it measures the Django/DRF side only.
+# It reads the current database (run populate_db first) and logs in as --username (default 'admin').
+# Throttling is off for the run (every DEFAULT_THROTTLE_RATES scope set to None), as in benchmark_api.
+
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.models import User, Product
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks sync (WSGI) vs async (ASGI) endpoints: requests/sec and latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--username', default='admin')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        product = Product.objects.order_by('pk').first()
+        if user is None or product is None:
+            raise CommandError(f'Needs products and the user "{options["username"]}". Run: python manage.py populate_db')
+
+        endpoints = [
+            'products/',
+            f'products/{product.pk}/',
+            'products/info/',
+            'orders/?page_size=20',
+        ]
+
+        rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+        unthrottled = override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': dict.fromkeys(rates)})
+        setup_test_environment()        # Allows the 'testserver' host of the test clients
+        unthrottled.enable()
+        try:
+            client = Client()
+            client.force_login(user)
+
+            for endpoint in endpoints:
+                wsgi = self.run_wsgi(f'/api/{endpoint}', client.cookies, options['requests'], options['concurrency'])
+                asgi = asyncio.run(self.run_asgi(f'/api/async/{endpoint}', client.cookies, options['requests'], options['concurrency']))
+                for mode, result in (('WSGI', wsgi), ('ASGI', asgi)):
+                    self.stdout.write(self.format_result(endpoint, mode, result))
+        finally:
+            unthrottled.disable()
+            teardown_test_environment()
+
+    def run_wsgi(self, path, cookies, total, concurrency):
+        local = threading.local()
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()             # One client per thread
+                local.client.cookies = cookies
+            start = time.perf_counter()
+            response = local.client.get(path)
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(request, range(total)))
+        return results, time.perf_counter() - start
+
+    async def run_asgi(self, path, cookies, total, concurrency):
+        client = AsyncClient()
+        client.cookies = cookies
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(request() for _ in range(total)))
+        return results, time.perf_counter() - start
+
+    def format_result(self, endpoint, mode, result):
+        results, elapsed = result
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, status_code in results if status_code >= 400)
+        percentiles = statistics.quantiles(latencies, n=100)        # percentiles[49] = p50, percentiles[98] = p99
+        return (
+            f'{endpoint:<22} {mode}  {len(results) / elapsed:8.1f} req/s   '
+            f'p50: {percentiles[49] * 1000:7.1f} ms   p99: {percentiles[98] * 1000:7.1f} ms   errors: {errors}'
+        )
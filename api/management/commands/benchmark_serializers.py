@@ -0,0 +1,76 @@
+# This script compares the per-row serialization cost of the ModelSerializers and the fast read serializers.
+# The benchmark data is created inside a transaction that is rolled back. Nothing is left in the database.
+
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import lorem_ipsum
+
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import FastProductSerializer, FastOrderSerializer
+from api.models import User, Product, Order, OrderItem
+from api.serializers import ProductSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks ModelSerializer vs fast read serializer (per row cost)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=300)       # SQLite: the prefetch IN (...) of the normal path fails with much more
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_data(options)
+
+            cases = [
+                ('products', Product.objects.order_by('pk'), ProductSerializer, FastProductSerializer),
+                ('orders', Order.objects.prefetch_related('items').order_by('pk'), OrderSerializer, FastOrderSerializer),
+            ]
+            for name, queryset, serializer_class, fast_serializer_class in cases:
+                rows = queryset.count()
+                slow = self.measure(serializer_class, queryset, options['repeat'])
+                fast = self.measure(fast_serializer_class, queryset, options['repeat'])
+                identical = self.render(serializer_class, queryset) == self.render(fast_serializer_class, queryset)
+
+                self.stdout.write(
+                    f'{name:<10} rows={rows:<7} '
+                    f'{serializer_class.__name__}: {slow / rows * 1e6:8.2f} us/row   '
+                    f'{fast_serializer_class.__name__}: {fast / rows * 1e6:8.2f} us/row   '
+                    f'speedup: {slow / fast:5.1f}x   identical: {identical}'
+                )
+
+            transaction.set_rollback(True)          # Don't keep the benchmark data
+
+    def create_data(self, options):
+        user = User.objects.create_user(username='benchmark_serializers_user')
+        description = lorem_ipsum.paragraph()
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description=description, price=Decimal(i % 1000) + Decimal('0.99'), stock=i % 50)
+            for i in range(options['products'])
+        ])
+        orders = Order.objects.bulk_create([Order(user=user) for _ in range(options['orders'])])
+        OrderItem.objects.bulk_create([
+            OrderItem.for_product(products[(i * 7 + j) % len(products)], order=order, quantity=j + 1)
+            for i, order in enumerate(orders)
+            for j in range(options['items_per_order'])
+        ])
+
+    def render(self, serializer_class, queryset):
+        return JSONRenderer().render(serializer_class(queryset, many=True).data)
+
+    def measure(self, serializer_class, queryset, repeat):
+        """
+        Best of `repeat` runs. Includes the DB queries, because the fast serializer reads different columns.
+        """
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serializer_class(queryset.all(), many=True).data      # .all() -> fresh queryset, no result cache
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,42 @@
+# This script exports every product to a CSV or NDJSON file (the format import_products reads).
+# Rows are read from the DB with .iterator() and written one by one, so memory does not grow with the catalog.
+# Example: python manage.py export_products catalog.ndjson
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog import FIELDS, FORMATS, Progress, RowWriter, guess_format
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Exports products to a CSV / NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, '-' for stdout")
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension (.ndjson/.jsonl, else csv)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = guess_format(path, options['format'])
+        # With '-' the data goes to stdout, so the progress goes to stderr.
+        progress = Progress(self.stderr if path == '-' else self.stdout)
+
+        try:
+            file = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        try:
+            writer = RowWriter(file, file_format)
+            rows = Product.objects.order_by('pk').values_list(*FIELDS)
+            for values in rows.iterator(chunk_size=options['chunk_size']):
+                writer.write(values)
+                progress.update(1)
+        finally:
+            if file is not sys.stdout:
+                file.close()
+
+        progress.stream.write(self.style.SUCCESS(f'Exported {progress.format()}'))
@@ -0,0 +1,252 @@
+# This script generates a big synthetic dataset (users, products, orders, order items) for benchmarks.
+# Same --seed -> same dataset on every run (names, prices, order contents, dates, order UUIDs),
+# also with a different number of --processes. So benchmark numbers of different runs can be compared.
+# Example: python manage.py generate_data --users 10000 --products 100000 --orders 3000000 --processes 8
+#
+# Distributions (close to a real shop):
+#   - items per order: geometric with mean --avg-items (most orders have 1-2 lines, a few have many)
+#   - products: Zipf-like popularity (a few products are in many orders)
+#   - quantity: mostly 1, sometimes up to 5
+#   - status: 70% Confirmed, 20% Pending, 10% Cancelled. created_at: spread over the --days before 2026-01-01
+# Generated rows are marked (sku 'LOAD-...', username 'loadtest_...'). --flush deletes them first.
+# Stock is not reserved for the generated orders (like populate_db).
+
+import bisect
+import datetime
+import math
+import multiprocessing
+import random
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from functools import partial
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils import lorem_ipsum
+
+from api import tasks
+from api.cache import bump_order_versions, product_version
+from api.models import User, Product, Order, OrderItem
+from api.search import get_search_backend
+
+SKU_PREFIX = 'LOAD-'
+USERNAME_PREFIX = 'loadtest_'
+END_DATE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+QUANTITIES = [1, 2, 3, 4, 5]
+QUANTITY_WEIGHTS = list(accumulate([60, 25, 10, 3, 2]))
+STATUSES = [Order.StatusChoices.CONFIRMED, Order.StatusChoices.PENDING, Order.StatusChoices.CANCELLED]
+STATUS_WEIGHTS = list(accumulate([70, 20, 10]))
+
+# Filled in every worker process by init_worker()
+_worker = {}
+
+
+def weighted_index(cumulative_weights, rng):
+    index = bisect.bisect_right(cumulative_weights, rng.random() * cumulative_weights[-1])
+    return min(index, len(cumulative_weights) - 1)        # Float rounding can give the total itself
+
+
+def chunk_rng(seed, name, index):
+    # One generator per chunk (not per process): the data doesn't depend on which process makes which chunk.
+    return random.Random(f'{seed}-{name}-{index}')
+
+
+def init_worker(options, product_pks, product_cents, product_names, user_pks):
+    popularity = (1 / (rank + 1) ** options['zipf'] for rank in range(len(product_pks)))
+    _worker.update(
+        options=options,
+        product_pks=product_pks,
+        product_cents=product_cents,
+        product_names=product_names,
+        user_pks=user_pks,
+        product_weights=list(accumulate(popularity)),
+    )
+
+
+def generate_orders(index):
+    """
+    Creates orders [index * chunk_size, (index + 1) * chunk_size) and their items. Runs in a worker process.
+    """
+    options = _worker['options']
+    product_pks, product_cents, user_pks = _worker['product_pks'], _worker['product_cents'], _worker['user_pks']
+    product_names = _worker['product_names']
+    product_weights = _worker['product_weights']
+    rng = chunk_rng(options['seed'], 'orders', index)
+
+    first = index * options['chunk_size']
+    count = min(options['chunk_size'], options['orders'] - first)
+    seconds = options['days'] * 24 * 60 * 60
+    max_items = min(options['max_items'], len(product_pks))
+    p = 1 / options['avg_items']
+
+    orders = []
+    items = []
+    for _ in range(count):
+        # Geometric number of lines: 1 + floor(log(U) / log(1 - p)), capped at max_items
+        lines = 1 if p >= 1 else min(max_items, 1 + int(math.log(1.0 - rng.random()) / math.log(1 - p)))
+        products = set()
+        while len(products) < lines:
+            products.add(weighted_index(product_weights, rng))
+
+        order = Order(
+            order_id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            user_id=user_pks[rng.randrange(len(user_pks))],
+            created_at=END_DATE - datetime.timedelta(seconds=rng.randrange(seconds)),
+            status=STATUSES[weighted_index(STATUS_WEIGHTS, rng)],
+            item_count=lines,
+        )
+        cents = 0
+        for product in sorted(products):
+            quantity = QUANTITIES[weighted_index(QUANTITY_WEIGHTS, rng)]
+            cents += product_cents[product] * quantity
+            items.append(OrderItem(
+                order=order, product_id=product_pks[product], quantity=quantity,
+                product_name=product_names[product], unit_price=Decimal(product_cents[product]) / 100,     # Snapshot
+            ))
+        order.total_price = Decimal(cents) / 100
+        orders.append(order)
+
+    with transaction.atomic():                  # created_at is kept (default=timezone.now, not auto_now_add)
+        Order.objects.bulk_create(orders, batch_size=options['batch_size'])
+        OrderItem.objects.bulk_create(items, batch_size=options['batch_size'])
+    return len(orders), len(items)
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic synthetic dataset (users, products, orders) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--avg-items', type=float, default=3.0, help='Mean number of lines per order')
+        parser.add_argument('--max-items', type=int, default=20)
+        parser.add_argument('--zipf', type=float, default=1.0, help='Product popularity skew (0 = uniform)')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes for the orders (SQLite: keep 1)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Orders per worker task (one transaction)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT')
+        parser.add_argument('--flush', action='store_true', help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['products'] < 1 or options['avg_items'] < 1:
+            raise CommandError('Needs at least 1 user, 1 product and --avg-items >= 1')
+
+        generated_products = Product.objects.filter(sku__startswith=SKU_PREFIX)
+        generated_users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if options['flush']:
+            self.step('Flush', self.flush, generated_users, generated_products)
+        elif generated_products.exists() or generated_users.exists():
+            raise CommandError('Generated data already exists. Use --flush to replace it.')
+
+        if not User.objects.filter(username='admin').exists():                  # Same superuser as populate_db
+            User.objects.create_superuser(username='admin', password='test')
+
+        user_pks = self.step('Users', self.create_users, options)
+        product_pks, product_cents, product_names = self.step('Products', self.create_products, options)
+        orders, items = self.step('Orders', self.create_orders, options, product_pks, product_cents, product_names, user_pks)
+
+        # bulk_create skips the Product / Order signals
+        product_version.bump()
+        bump_order_versions(user_pks)
+        with transaction.atomic():
+            self.step('Search index', get_search_backend().rebuild)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_pks)} users, {len(product_pks)} products, {orders} orders, {items} order items'
+        ))
+
+    def step(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f'{name}: {time.perf_counter() - start:.1f}s')
+        return result
+
+    def flush(self, generated_users, generated_products):
+        # Plain DELETE statements for orders / products. delete() would load every row in memory and send a signal
+        # per row. Their signals' work is done here (order lists) and at the end (product version, search index).
+        user_pks = list(generated_users.values_list('pk', flat=True))
+        with transaction.atomic():
+            OrderItem.objects.filter(Q(order__user__in=generated_users) | Q(product__in=generated_products)).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Order._meta.db_table} WHERE user_id IN "
+                    f"(SELECT id FROM {User._meta.db_table} WHERE username LIKE %s ESCAPE '\\')",
+                    [USERNAME_PREFIX.replace('_', '\\_') + '%'],
+                )
+                cursor.execute(f'DELETE FROM {Product._meta.db_table} WHERE sku LIKE %s', [SKU_PREFIX + '%'])
+            generated_users.delete()            # Few rows. Its signals drop the users' cached JWTs (api/authentication.py)
+            transaction.on_commit(partial(bump_order_versions, user_pks))
+
+    def create_users(self, options):
+        password = make_password('test', salt=f'loadtest{options["seed"]}')      # Hashed once, not per user
+        users = [
+            User(username=f'{USERNAME_PREFIX}{i:07d}', email=f'{USERNAME_PREFIX}{i:07d}@example.com', password=password)
+            for i in range(options['users'])
+        ]
+        User.objects.bulk_create(users, batch_size=options['batch_size'])
+        return array('q', User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('username').values_list('pk', flat=True))
+
+    def create_products(self, options):
+        words = lorem_ipsum.WORDS
+        batch = []
+        for index in range(0, options['products'], options['chunk_size']):
+            rng = chunk_rng(options['seed'], 'products', index)
+            for i in range(index, min(index + options['chunk_size'], options['products'])):
+                cents = max(99, int(rng.lognormvariate(8, 1.2)))            # Most prices 10-100, a few expensive ones
+                batch.append(Product(
+                    sku=f'{SKU_PREFIX}{i:08d}',
+                    name=' '.join(rng.choices(words, k=rng.randint(1, 4))).capitalize(),
+                    description=' '.join(rng.choices(words, k=rng.randint(10, 60))).capitalize() + '.',
+                    price=Decimal(cents) / 100,
+                    stock=rng.randint(0, 500),
+                ))
+            with transaction.atomic():
+                Product.objects.bulk_create(batch, batch_size=options['batch_size'])
+            batch = []
+
+        rows = Product.objects.filter(sku__startswith=SKU_PREFIX).order_by('sku').values_list('pk', 'price', 'name')
+        product_pks, product_cents, product_names = array('q'), array('q'), []
+        for pk, price, name in rows.iterator(chunk_size=options['batch_size']):
+            product_pks.append(pk)
+            product_cents.append(int(price * 100))
+            product_names.append(name)                  # For the order items' snapshot
+        return product_pks, product_cents, product_names
+
+    def create_orders(self, options, product_pks, product_cents, product_names, user_pks):
+        # Only plain values go to the workers (not the whole options dict: it has stdout etc.)
+        worker_options = {name: options[name] for name in (
+            'orders', 'avg_items', 'max_items', 'zipf', 'days', 'seed', 'chunk_size', 'batch_size',
+        )}
+        chunks = range(math.ceil(options['orders'] / options['chunk_size']))
+        initargs = (worker_options, product_pks, product_cents, product_names, user_pks)
+
+        if options['processes'] <= 1:
+            init_worker(*initargs)
+            results = map(generate_orders, chunks)
+            return self.collect(results, options['orders'])
+
+        connections.close_all()             # Forked workers must not share the parent's DB connection
+        # The platform's default start method ('fork' on Linux, 'spawn' on macOS / Windows). A spawned worker sets
+        # Django up before this module can be imported: tasks.init_worker does that, then calls our init_worker.
+        context = multiprocessing.get_context()
+        initargs = (f'{__name__}.init_worker', *initargs)
+        with ProcessPoolExecutor(options['processes'], mp_context=context, initializer=tasks.init_worker, initargs=initargs) as pool:
+            return self.collect(pool.map(generate_orders, chunks), options['orders'])
+
+    def collect(self, results, total):
+        orders = items = 0
+        start = time.perf_counter()
+        for chunk_orders, chunk_items in results:
+            orders += chunk_orders
+            items += chunk_items
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'  {orders}/{total} orders, {items} items ({items / elapsed:.0f} items/s)')
+        return orders, items
@@ -0,0 +1,28 @@
+# This script queues the making of product image renditions (thumbnails, see api/images.py).
+# New uploads get theirs automatically. Run it for images that were there before, or with --all after
+# changing PRODUCT_IMAGE_SIZES / PRODUCT_IMAGE_FORMATS / PRODUCT_IMAGE_QUALITY.
+# The work is done by the background worker, in parallel: python manage.py run_tasks --processes 4
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.images import generate_renditions, needs_renditions
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Queues the image renditions of products that need them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Every product with an image, also the ones that have renditions')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'image_renditions')
+        queued = 0
+        with transaction.atomic():                  # The tasks are queued on commit
+            for product in products.iterator(chunk_size=2000):
+                if options['all'] or needs_renditions(product):
+                    generate_renditions.delay(product.pk)
+                    queued += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Queued renditions for {queued} products. Run: python manage.py run_tasks'))
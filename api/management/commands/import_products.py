@@ -0,0 +1,82 @@
+# This script imports (upserts) products from a CSV or NDJSON file. See api/catalog.py for the columns.
+# Rows are streamed from the file and written with one INSERT ... ON CONFLICT (sku) DO UPDATE per batch,
+# each batch in its own transaction. Invalid rows are skipped and reported.
+# Example: python manage.py import_products catalog.csv --batch-size 2000
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import product_version
+from api.catalog import FORMATS, Progress, ProductRowValidator, guess_format, read_rows
+from api.models import Product
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Imports products from a CSV / NDJSON file (upsert on sku)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension (.ndjson/.jsonl, else csv)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-errors', type=int, default=20, help='How many invalid rows are printed')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = guess_format(path, options['format'])
+        self.batch_size = options['batch_size']
+        self.max_errors = options['max_errors']
+        self.invalid = 0
+
+        validator = ProductRowValidator()
+        self.progress = Progress(self.stdout)
+
+        try:
+            file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        try:
+            # The dict keeps the last row of a sku: one INSERT can't update the same row twice.
+            batch = {}
+            for line_number, row in read_rows(file, file_format):
+                data, errors = validator.validate(row)
+                if errors:
+                    self.report_error(line_number, errors)
+                    continue
+
+                batch[data['sku']] = Product(**data)
+                if len(batch) >= self.batch_size:
+                    self.save_batch(batch)
+                    batch = {}
+            if batch:
+                self.save_batch(batch)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        # bulk_create skips the Product signals: do their work once for the whole import.
+        product_version.bump()
+        with transaction.atomic():
+            get_search_backend().rebuild()
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {self.progress.format()}. Invalid rows: {self.invalid}'))
+
+    def save_batch(self, batch):
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                batch.values(),
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=['name', 'description', 'price', 'stock', 'updated_at'],      # updated_at: auto_now value of the new row
+            )
+        self.progress.update(len(batch))
+
+    def report_error(self, line_number, errors):
+        self.invalid += 1
+        if self.invalid <= self.max_errors:
+            self.stderr.write(f'Line {line_number}: {errors}')
+        elif self.invalid == self.max_errors + 1:
+            self.stderr.write('More invalid rows are not printed ...')
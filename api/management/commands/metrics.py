@@ -0,0 +1,85 @@
+# This script shows the request metrics of a running server (see api/metrics.py) as a table.
+# The histograms live in the memory of the server process, so they are read from GET /api/metrics/
+# with the JWT of an admin user (--username).
+# Examples:
+#   python manage.py metrics                                     # http://localhost:8000, user 'admin'
+#   python manage.py metrics --sort sql_count
+#   python manage.py metrics --json > metrics.json
+#   python manage.py metrics --reset                             # Start again (e.g. before a benchmark)
+
+import json
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import User
+
+SORT_KEYS = ('request_ms', 'sql_ms', 'sql_count', 'serializer_ms', 'count')
+
+
+def format_table(snapshot, sort='request_ms'):
+    header = (
+        f'{"view":<40} {"n":>6}  {"request p50/p95/p99 ms":>22}  {"sql p95 ms":>10}  '
+        f'{"queries p50/max":>15}  {"serializer p95 ms":>17}  status codes'
+    )
+    lines = [header, '-' * len(header)]
+
+    def sort_value(item):
+        view = item[1]
+        if sort == 'count':
+            return view['request_ms']['count']
+        return view[sort]['p95'] or 0
+
+    def number(value):
+        return '-' if value is None else f'{value:g}'
+
+    for name, view in sorted(snapshot['views'].items(), key=sort_value, reverse=True):
+        request, sql, queries, serializer = view['request_ms'], view['sql_ms'], view['sql_count'], view['serializer_ms']
+        latency = '/'.join(number(request[p]) for p in ('p50', 'p95', 'p99'))
+        query_count = f'{number(queries["p50"])}/{number(queries["max"])}'
+        status_codes = ' '.join(f'{code}:{count}' for code, count in view['status_codes'].items())
+        lines.append(
+            f'{name:<40} {request["count"]:>6}  {latency:>22}  {number(sql["p95"]):>10}  '
+            f'{query_count:>15}  {number(serializer["p95"]):>17}  {status_codes}'
+        )
+    lines.append(f'Sample rate: {snapshot["sample_rate"]:g} (X-Profile header requests are always sampled)')
+    return '\n'.join(lines)
+
+
+class Command(BaseCommand):
+    help = 'Shows the per-view request / SQL / serializer histograms of a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='The running server')
+        parser.add_argument('--username', default='admin', help='An admin user (the endpoint is admin only)')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='request_ms', help='Sort by p95 of (or number of requests)')
+        parser.add_argument('--json', action='store_true', help='Print the raw JSON')
+        parser.add_argument('--reset', action='store_true', help='Clear the metrics of the server')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None or not user.is_staff:
+            raise CommandError(f'"{options["username"]}" must be an existing admin user')
+        token = str(RefreshToken.for_user(user).access_token)
+
+        snapshot = self.fetch(options['url'], token, 'DELETE' if options['reset'] else 'GET')
+        if options['reset']:
+            self.stdout.write(self.style.SUCCESS('Metrics cleared'))
+        elif options['json']:
+            self.stdout.write(json.dumps(snapshot, indent=2))
+        else:
+            self.stdout.write(format_table(snapshot, options['sort']))
+
+    def fetch(self, url, token, method):
+        request = urllib.request.Request(
+            f'{url.rstrip("/")}/api/metrics/', method=method, headers={'Authorization': f'Bearer {token}'},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read()
+        except (urllib.error.URLError, OSError) as exc:
+            raise CommandError(f'Could not read the metrics from {url}: {exc}')
+        return json.loads(body) if body else None
@@ -38,4 +38,5 @@ class Command(BaseCommand):
             for product in random.sample(list(products), 2):
                 OrderItem.objects.create(
                     order=order, product=product, quantity=random.randint(1,3)
-                )
\ No newline at end of file
+                )
+            order.recalculate_totals()
\ No newline at end of file
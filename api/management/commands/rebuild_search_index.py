@@ -0,0 +1,24 @@
+# This script rebuilds the product full-text search index (see api/search.py).
+# Run it after bulk writes that skip the Product signals (bulk_create, QuerySet.update, raw SQL, loaddata).
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index'
+
+    def handle(self, *args, **kwargs):
+        backend = get_search_backend()
+        start = time.perf_counter()
+
+        with transaction.atomic():
+            indexed = backend.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{type(backend).__name__}: indexed {indexed} products in {time.perf_counter() - start:.2f}s'
+        ))
@@ -0,0 +1,67 @@
+# This script is the background task worker (see api/tasks.py).
+# It polls the Task table, claims the ready tasks and runs them, in --processes worker processes.
+# Several workers (also on other machines) can run at the same time: a task is claimed by one of them only.
+# Example: python manage.py run_tasks --processes 4
+#          python manage.py run_tasks --burst          (run what is queued, then exit: cron, CI, tests)
+
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.tasks import claim_tasks, init_worker, make_worker_id, run_pooled_task, run_task
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes (1 = run the tasks in this process)')
+        parser.add_argument('--batch-size', type=int, help='Tasks claimed per poll (default: 4 per process)')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls while the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit when no task is ready')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        # Small batches: a claimed task waits for the others of its batch, and TASK_TIMEOUT counts from the claim
+        batch_size = options['batch_size'] or 4 * options['processes']
+        worker_id = make_worker_id()
+
+        pool = None
+        if options['processes'] > 1:
+            # 'spawn' (not the platform default like generate_data): long lived processes that set Django up
+            # themselves and share no DB connection or lock with this one
+            context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(options['processes'], mp_context=context, initializer=init_worker)
+            run = pool.map
+        else:
+            run = map
+
+        results = Counter()
+        self.stdout.write(f'Worker {worker_id}: {options["processes"]} process(es)')
+        try:
+            while True:
+                task_ids = claim_tasks(batch_size, worker_id)
+                if not task_ids:
+                    if options['burst']:
+                        break
+                    close_old_connections()             # Idle: don't keep a stale connection around
+                    time.sleep(options['interval'])
+                    continue
+                batch = Counter(run(run_pooled_task if pool else run_task, task_ids))
+                results.update(batch)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{len(task_ids)} tasks: {dict(batch)}')
+        except KeyboardInterrupt:
+            pass                                        # Claimed tasks that didn't finish are queued again after TASK_TIMEOUT
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {results['done']}, retried: {results['retry']}, failed: {results['failed']}"
+        ))
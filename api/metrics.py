@@ -0,0 +1,278 @@
+import bisect
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, asynccontextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from api.query_budget import get_action, is_counted
+
+"""
+Lightweight request metrics (the always-on replacement for Silk).
+
+Silk writes every request, response body and SQL query to the DB: about one extra write per query.
+Now:
+    - METRICS_SAMPLE_RATE of the requests (e.g. 0.1 = 10%) are timed: request time, SQL time and count
+      (connection.execute_wrapper), serializer time (.data of the view's serializer, SerializerTimingMixin).
+      Nothing is written anywhere: the numbers go to in-memory histograms per view ('OrderViewSet.list', ...).
+    - A histogram has fixed buckets, so memory doesn't grow with traffic and observe() is one bisect.
+      Percentiles are the upper bound of the bucket (p95 = 50 means "between 25 and 50 ms").
+    - Full Silk capture only runs for SILK_SAMPLE_RATE of the requests (SILKY_INTERCEPT_FUNC in settings)
+      or when the request has the 'X-Profile: <METRICS_PROFILE_TOKEN>' header (only if a token is set: None = header ignored).
+      That header also forces the metrics sample.
+
+Read them with GET /api/metrics/ (admin, DELETE resets) or: python manage.py metrics --url http://localhost:8000
+The numbers are per process: with 4 gunicorn workers each one has its own (the endpoint shows the one that answered).
+Serializing a StreamingHttpResponse happens after the view returned and is not timed.
+"""
+
+TIME_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50, 100, 200, 500)
+
+PROFILE_HEADER = 'X-Profile'
+
+_current_sample = ContextVar('metrics_sample', default=None)
+
+
+class Histogram:
+    """
+    counts[i] = number of values <= bounds[i] (and > bounds[i - 1]). The last one counts values above every bound.
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 3) if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': round(self.max, 3),
+            'buckets': {str(bound): count for bound, count in zip((*self.bounds, 'inf'), self.counts)},
+        }
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.request_ms = Histogram(TIME_BUCKETS_MS)
+        self.sql_ms = Histogram(TIME_BUCKETS_MS)
+        self.sql_count = Histogram(COUNT_BUCKETS)
+        self.serializer_ms = Histogram(TIME_BUCKETS_MS)
+        self.status_codes = Counter()
+
+    def to_dict(self):
+        return {
+            'request_ms': self.request_ms.to_dict(),
+            'sql_ms': self.sql_ms.to_dict(),
+            'sql_count': self.sql_count.to_dict(),
+            'serializer_ms': self.serializer_ms.to_dict(),
+            'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+        }
+
+
+class Metrics:
+    """
+    The histograms of every view of this process. Thread safe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.started_at = time.time()
+
+    def record(self, sample, status_code):
+        with self.lock:
+            view = self.views.get(sample.view_name)
+            if view is None:
+                view = self.views[sample.view_name] = ViewMetrics()
+            view.request_ms.observe(sample.request_ms)
+            view.sql_ms.observe(sample.sql_ms)
+            view.sql_count.observe(sample.sql_count)
+            view.serializer_ms.observe(sample.serializer_ms)
+            view.status_codes[status_code] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'sample_rate': getattr(settings, 'METRICS_SAMPLE_RATE', 0),
+                'views': {name: view.to_dict() for name, view in sorted(self.views.items())},
+            }
+
+
+metrics = Metrics()
+
+
+class Sample:
+    """
+    The numbers of one sampled request. Also the execute_wrapper that times its queries.
+    """
+    def __init__(self):
+        self.view_name = '(no view)'            # 404 before a view was found, etc.
+        self.request_ms = 0
+        self.sql_ms = 0
+        self.sql_count = 0
+        self.serializer_ms = 0
+
+    def timing_queries(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    @asynccontextmanager
+    async def atiming_queries(self):
+        # The ORM of an async request runs in a sync_to_async() thread (one per request under ASGI),
+        # with that thread's connections: the wrappers are added and removed there
+        stack = await sync_to_async(self.timing_queries)()
+        try:
+            yield
+        finally:
+            await sync_to_async(stack.close)()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not is_counted(sql):                 # Silk's own queries
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - start) * 1000
+            self.sql_count += 1
+
+
+def has_profile_header(request):
+    token = getattr(settings, 'METRICS_PROFILE_TOKEN', None)
+    return bool(token) and request.headers.get(PROFILE_HEADER) == token
+
+
+def silk_intercept(request):
+    """
+    SILKY_INTERCEPT_FUNC: which requests Silk captures in full.
+    """
+    return has_profile_header(request) or random.random() < getattr(settings, 'SILK_SAMPLE_RATE', 0)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.is_sampled(request):
+            return self.get_response(request)       # Not sampled: nothing else runs
+
+        sample = Sample()
+        token = _current_sample.set(sample)
+        start = time.perf_counter()
+        try:
+            with sample.timing_queries():
+                response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        return self.record(sample, start, response)
+
+    async def __acall__(self, request):
+        if not self.is_sampled(request):
+            return await self.get_response(request)
+
+        sample = Sample()
+        token = _current_sample.set(sample)         # Copied into the sync_to_async() threads with the context
+        start = time.perf_counter()
+        try:
+            async with sample.atiming_queries():
+                response = await self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        return self.record(sample, start, response)
+
+    def is_sampled(self, request):
+        return has_profile_header(request) or random.random() < getattr(settings, 'METRICS_SAMPLE_RATE', 0)
+
+    def record(self, sample, start, response):
+        sample.request_ms = (time.perf_counter() - start) * 1000
+        metrics.record(sample, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = _current_sample.get()
+        if sample is not None:
+            view_class = getattr(view_func, 'cls', None)
+            name = view_class.__name__ if view_class else view_func.__name__
+            sample.view_name = f'{name}.{get_action(view_func, request)}'
+
+
+class TimedSerializer:
+    """
+    Wraps the serializer of a sampled request: reading `data` (where DRF runs to_representation() for a response)
+    adds its time to the sample. Everything else is the serializer's own: its class is never changed.
+    """
+    def __init__(self, serializer):
+        object.__setattr__(self, 'serializer', serializer)
+
+    @property
+    def data(self):
+        sample = _current_sample.get()
+        if sample is None:                      # e.g. a streamed response, after the request was recorded
+            return self.serializer.data
+        start = time.perf_counter()
+        try:
+            return self.serializer.data
+        finally:
+            sample.serializer_ms += (time.perf_counter() - start) * 1000
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.serializer, name, value)
+
+
+class SerializerTimingMixin:
+    """
+    View mixin (first base, so it sees the serializer of FastReadMixin too). In a sampled request
+    get_serializer() returns the serializer in a TimedSerializer. Other requests get the serializer itself.
+    """
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if _current_sample.get() is not None:
+            return TimedSerializer(serializer)
+        return serializer
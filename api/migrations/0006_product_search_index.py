@@ -0,0 +1,51 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:00
+
+from django.db import migrations
+
+# The DDL is copied here (not taken from api/search.py): a migration must create the same index
+# whatever the search code looks like later.
+SQLITE_TABLE = 'api_product_fts'
+POSTGRES_INDEX = 'product_search_vector_idx'
+
+
+def get_gin_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    # Same expression as PostgresSearchBackend.get_vector(), otherwise PostgreSQL won't use the index
+    return GinIndex(SearchVector('name', 'description', config='english'), name=POSTGRES_INDEX)
+
+
+def create_search_index(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+            "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(                  # Existing products
+            f'INSERT INTO {SQLITE_TABLE} (rowid, name, description) '
+            f'SELECT id, name, description FROM {Product._meta.db_table}'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.add_index(Product, get_gin_index())
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('api', 'Product'), get_gin_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_filter_indexes'),
+    ]
+
+    operations = [
+        # SQLite: FTS5 table, PostgreSQL: GIN index, other databases: nothing (LIKE search). See api/search.py
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
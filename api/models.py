@@ -1,6 +1,7 @@
 import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 # Create your models here.
 class User(AbstractUser):
@@ -13,6 +14,18 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of image, made by the background worker: {'source': image name, 'renditions': {...}}. See api/images.py
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True)      # Catalog key for import_products / export_products
+    # ETag / Last-Modified (api/conditional.py). QuerySet.update() doesn't set auto_now: set it there too (see api/stock.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # InStockFilterBackend always adds 'stock > 0'. Partial index: only in-stock rows, sorted by price
+            # (ProductFilter price lt/gt/range and ?ordering=price, 'id' for the keyset tiebreaker).
+            models.Index(fields=['price', 'id'], condition=models.Q(stock__gt=0), name='product_in_stock_price_idx'),
+        ]
 
     @property
     def in_stock(self):
@@ -30,7 +43,9 @@ class Order(models.Model):
     
     order_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Like auto_now_add for save() and the API, but an explicit value is kept (bulk_create of generate_data's past dates)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)           # ETag of the order (api/conditional.py)
     status = models.CharField(
         max_length=10,
         choices=StatusChoices.choices,
@@ -38,10 +53,51 @@ class Order(models.Model):
     )
     product = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
 
+    # Precomputed from the items so reads don't need to load items/products to show totals.
+    # Kept up to date by OrderCreateSerializer (create/update) and recalculate_totals().
+    # Existing rows can be filled with: python manage.py backfill_order_totals
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)        # Number of order lines (OrderItem rows)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (created_at, order_id). See api/pagination.py
+            models.Index(fields=['created_at', 'order_id'], name='order_created_keyset_idx'),
+            # Non staff users only see their own orders (OrderViewSet.get_queryset) + OrderFilter on created_at
+            models.Index(fields=['user', 'created_at', 'order_id'], name='order_user_created_idx'),
+            # OrderFilter ?status=
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.order_id} | {self.user.username} | {self.status}"
 
+    @classmethod
+    def totals_annotation(cls):
+        """
+        Aggregates to compute the totals in the DB, e.g. Order.objects.annotate(**Order.totals_annotation())
+        """
+        return {
+            'computed_total_price': models.Sum(
+                models.F('items__unit_price') * models.F('items__quantity'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            'computed_item_count': models.Count('items'),
+        }
+
+    def recalculate_totals(self, save=True):
+        totals = self.items.aggregate(
+            total_price=models.Sum(
+                models.F('unit_price') * models.F('quantity'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=models.Count('pk'),
+        )
+        self.total_price = totals['total_price'] or 0
+        self.item_count = totals['item_count']
+        if save:
+            self.save(update_fields=['total_price', 'item_count', 'updated_at'])
+
     
 
 class OrderItem(models.Model):
@@ -50,12 +106,61 @@ class OrderItem(models.Model):
         on_delete=models.CASCADE,
         related_name='items',       # This name is used in the Nested Serializer. See OrderSerializer for more details.
     )
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # SET_NULL, not CASCADE: deleting a product keeps the order lines (name / price are snapshots below)
+    # and so the order's stored total_price / item_count stay right
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     quantity = models.PositiveIntegerField()
 
+    # Snapshot of the product when the item was ordered. Reading an order never needs the Product table,
+    # and repricing / renaming a product doesn't change old orders (or their totals).
+    product_name = models.CharField(max_length=200)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    @classmethod
+    def for_product(cls, product, **kwargs):
+        return cls(product=product, product_name=product.name, unit_price=product.price, **kwargs)
+
+    def save(self, *args, **kwargs):
+        # Items created without a snapshot (admin inline, shell) take the current product values
+        if self.unit_price is None:
+            self.product_name = self.product.name
+            self.unit_price = self.product.price
+        super().save(*args, **kwargs)
+
     @property
     def item_subtotal(self):
-        return self.product.price * self.quantity
+        return self.unit_price * self.quantity
     
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order {self.order.order_id}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product_name} in Order {self.order_id}"
+
+class Task(models.Model):
+    """
+    A queued background task (api/tasks.py), run by: python manage.py run_tasks
+    Done tasks are deleted. Failed ones stay (last_error) until someone looks at them.
+    """
+    class StatusChoices(models.TextChoices):
+        QUEUED = 'Queued'
+        RUNNING = 'Running'
+        FAILED = 'Failed'
+
+    name = models.CharField(max_length=200)                     # Registered name, e.g. 'api.search.sync_search_index'
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField()                          # Retries wait (backoff)
+    locked_at = models.DateTimeField(blank=True, null=True)     # When a worker claimed it
+    locked_by = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The worker's poll: WHERE status = 'Queued' AND run_after <= now ORDER BY run_after
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} | {self.status} | attempt {self.attempts}/{self.max_attempts}"
@@ -0,0 +1,241 @@
+import datetime
+import uuid
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+"""
+Keyset (a.k.a. seek / cursor) pagination.
+
+LimitOffsetPagination has to walk over every skipped row (OFFSET 50000 reads 50000 rows),
+so deep pages get slower and slower. Keyset pagination remembers the sort values of the last
+row we sent and asks the DB for "rows after these values" instead:
+
+    WHERE (price > 12.99) OR (price = 12.99 AND id > 42) ORDER BY price, id LIMIT 6
+
+With an index on the ordering columns page 10,000 costs the same as page 1.
+
+The cursor is the list of sort values of the boundary row, signed with SECRET_KEY so clients
+can't forge or tamper with it (it is opaque for them).
+The mode is opt-in: a client asks for it with ?page_size=N or by following a ?cursor= link.
+Without those parameters the view responds with the plain (unpaginated) list as before.
+AlwaysKeysetPagination always paginates (for endpoints that must never load the whole table).
+"""
+
+
+def _encode_value(value):
+    # JSON can't carry these types. Keep full precision (microseconds, all decimal places)
+    # otherwise rows sharing the truncated value would be skipped or repeated.
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Views can set `keyset_ordering` (default: ('pk',)). The last field of it must be unique,
+    it is used as a tiebreaker so the sort is stable even when ordering by 'price' or 'stock'.
+    If the view uses OrderingFilter, the client chosen ordering (?ordering=-price) is respected.
+    All ordering fields must be NOT NULL.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    default_ordering = ('pk',)
+    signing_salt = 'api.pagination.KeysetPagination'
+    invalid_cursor_message = 'Invalid cursor'
+    opt_in = True                               # False: always paginate, even without ?page_size=/?cursor=
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.prepare_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        # Fetch one extra row to know if there is something after this page.
+        return self.set_page(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Same as paginate_queryset() for async views (see api/async_views.py).
+        """
+        queryset = self.prepare_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset[:self.page_size + 1]])
+
+    def prepare_queryset(self, queryset, request, view):
+        # No DB query here, so it can be used by sync and async views.
+        self.request = request
+        if not self.is_requested(request):
+            return None                         # Client did not ask for pages. Keep the old behaviour.
+
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.base_url = request.build_absolute_uri()
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor['reverse'])
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self._invert(field) for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, self.cursor['values']))
+        return queryset
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = True                # We came back from the next page, so it exists.
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        self.page = results
+        return results
+
+    def is_requested(self, request):
+        if not self.opt_in:
+            return True
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        keyset_ordering = list(getattr(view, 'keyset_ordering', self.default_ordering))
+        tiebreaker = keyset_ordering[-1]
+
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, filters.OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+
+        ordering = list(ordering or keyset_ordering)
+        if tiebreaker.lstrip('-') not in [field.lstrip('-') for field in ordering]:
+            ordering.append(tiebreaker)
+        return ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            cursor = signing.loads(encoded, salt=self.signing_salt)
+        except signing.BadSignature:
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor made for another ?ordering= can't be applied to this one.
+        if cursor.get('ordering') != self.ordering or len(cursor.get('values', [])) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, instance, reverse):
+        cursor = {
+            'ordering': self.ordering,
+            'values': [_encode_value(getattr(instance, field.lstrip('-'))) for field in self.ordering],
+            'reverse': reverse,
+        }
+        encoded = signing.dumps(cursor, salt=self.signing_salt, compress=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Empty page (e.g. everything after the cursor got deleted). Go back to the first page.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _seek_filter(ordering, values):
+        """
+        Build the "row comes after the cursor" condition for a multi column sort:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        condition = Q()
+        equal_so_far = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+
+class AlwaysKeysetPagination(KeysetPagination):
+    """
+    For endpoints that must never return the whole table (memory stays constant).
+    """
+    opt_in = False
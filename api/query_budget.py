@@ -0,0 +1,149 @@
+import logging
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings
+
+"""
+Query budgets: the maximum number of DB queries a view may run for one request.
+
+An N+1 (e.g. a serializer field that reads order.user.username without select_related) is invisible
+with 3 test rows and a disaster with 3000. A budget makes it fail loudly instead:
+
+    class OrderViewSet(viewsets.ModelViewSet):
+        query_budget = {'list': 5, 'retrieve': 5, 'create': 9}     # ViewSet action names
+    class ProductInfoAPIView(generics.GenericAPIView):
+        query_budget = {'get': 4}                                 # HTTP methods for APIViews
+        # or query_budget = 4 for every method
+
+QueryBudgetMiddleware counts every query of the request (authentication included, it is part of the cost)
+with connection.execute_wrapper(), so it also works with DEBUG = False, and:
+    - adds the 'X-DB-Queries' response header if QUERY_BUDGET_HEADER is on (DEBUG; benchmark_api reads it from a live server)
+    - QUERY_BUDGET_MODE = 'warn'  -> logs a warning when a view goes over its budget
+      QUERY_BUDGET_MODE = 'raise' -> raises QueryBudgetExceeded (tests)
+      QUERY_BUDGET_MODE = None    -> off, nothing is counted
+Queries made while a StreamingHttpResponse is consumed (after the view returned) are not counted.
+The middleware is sync and async capable: under ASGI it counts in the request's sync_to_async() thread.
+"""
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = 'X-DB-Queries'
+
+
+# The silk middleware saves every request to the DB (+ EXPLAIN of each query, savepoints).
+# Those are not queries of the endpoint. Neither is the transaction control of atomic(): SQLite runs BEGIN
+# through the cursor, and inside a TestCase (one outer transaction) there is none, so budgets are the same in both.
+NOT_COUNTED = ('EXPLAIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+def is_counted(sql):
+    return 'silk_' not in sql and not sql.startswith(NOT_COUNTED)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """
+    Context manager counting the queries run on every DB connection of this thread.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if is_counted(sql):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+
+def get_action(view_func, request):
+    """
+    ViewSet action name ('list', 'summary' ...) or the lowercase HTTP method for other views.
+    """
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}             # ViewSets: {'get': 'list', 'post': 'create'}
+    return actions.get(method, method)
+
+
+def get_query_budget(view_func, request):
+    budget = getattr(getattr(view_func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(get_action(view_func, request))
+    return budget
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', None)
+        if not mode:
+            return self.get_response(request)
+
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        return self.check(request, response, counter.count, mode)
+
+    async def __acall__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', None)
+        if not mode:
+            return await self.get_response(request)
+
+        # The ORM of an async request runs in a sync_to_async() thread (one per request under ASGI),
+        # with that thread's connections: the counter is added and removed there
+        counter = QueryCounter()
+        await sync_to_async(counter.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(counter.__exit__)(None, None, None)
+        return self.check(request, response, counter.count, mode)
+
+    def check(self, request, response, count, mode):
+        if getattr(settings, 'QUERY_BUDGET_HEADER', False):
+            response[QUERY_COUNT_HEADER] = str(count)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and count > budget:
+            message = f'{request.method} {request.path}: {count} queries, budget is {budget}'
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request)
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin: a request made with self.client fails the test when its view goes over its budget.
+    """
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(QUERY_BUDGET_MODE='raise', QUERY_BUDGET_HEADER=True))
+
+    def assertQueryCount(self, response, expected):
+        self.assertEqual(int(response[QUERY_COUNT_HEADER]), expected)
@@ -0,0 +1,170 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from rest_framework import filters
+
+from api.cache import product_version
+from api.models import Product
+from api.tasks import task
+
+"""
+Full-text product search.
+
+SearchFilter with search_fields = ['=name', 'description'] turns ?search=tv into
+    WHERE name = 'tv' OR description LIKE '%tv%'
+A LIKE with a leading % can't use any index, so every search reads the whole product table.
+
+Here the search goes to a full-text index instead (only the matching rows are read) and results are ranked:
+    - SQLite:     FTS5 virtual table 'api_product_fts' (rowid = product id). Kept in sync by the
+                  Product save/delete signals (api/signals.py) with a background task (sync_search_index,
+                  api/tasks.py): the index is updated by the worker, not in the request. Without a worker
+                  (TASK_BACKEND != 'database') the signal updates it in the request, in the same transaction.
+                  Bulk writes (bulk_create, update) skip the signals, so after those run: python manage.py rebuild_search_index
+    - PostgreSQL: a GIN index on to_tsvector(name || description). The DB keeps it up to date by itself.
+    - Other DBs:  the old LIKE search (no index).
+The FTS5 table / GIN index is created by migration 0006_product_search_index.
+Each search term is a prefix match ('tele' finds 'Television') and all terms must match.
+When nothing matches that way, the old substring (LIKE) search runs instead, so e.g. 'vision' still finds
+'Television' (a full scan, but only for searches the index can't answer).
+"""
+
+
+class SQLiteSearchBackend:
+    table = 'api_product_fts'
+    needs_sync = True                   # index_product / remove_product do something
+
+    def populate_sql(self, model):
+        return f'INSERT INTO {self.table} (rowid, name, description) SELECT id, name, description FROM {model._meta.db_table}'
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(self.populate_sql(Product))
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.description]
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    @staticmethod
+    def match_expression(terms):
+        # "term"* = prefix match. Quotes make FTS5 operators (AND, NEAR, -, ...) in user input plain text.
+        return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, queryset, terms):
+        match = self.match_expression(terms)
+        product_table = Product._meta.db_table
+        # FTS5 'rank' is bm25(): smaller is better, so it's negated (bigger search_rank = better match)
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        ).annotate(search_rank=RawSQL(
+            f'SELECT -rank FROM {self.table} WHERE {self.table} MATCH %s AND rowid = {product_table}.id', [match]
+        ))
+
+
+class PostgresSearchBackend:
+    index_name = 'product_search_vector_idx'
+    config = 'english'
+    needs_sync = False
+
+    def get_vector(self):
+        from django.contrib.postgres.search import SearchVector
+        # Must stay the expression of the GIN index (migration 0006), otherwise PostgreSQL won't use the index
+        return SearchVector('name', 'description', config=self.config)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX {self.index_name}')
+        return Product.objects.count()
+
+    def index_product(self, product):
+        pass                # Expression index. PostgreSQL updates it with the row.
+
+    def remove_product(self, product_id):
+        pass
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        words = re.findall(r'\w+', ' '.join(terms))
+        if not words:
+            return queryset.none()
+        # 'tele':* & 'tv':*  -> prefix match, all words must match
+        query = SearchQuery(' & '.join(f"'{word}':*" for word in words), config=self.config, search_type='raw')
+        vector = self.get_vector()
+        return queryset.annotate(search_vector=vector).filter(search_vector=query).annotate(
+            search_rank=SearchRank(vector, query)
+        )
+
+
+class LikeSearchBackend:
+    """
+    Fallback for databases without a supported full-text index. FullTextSearchFilter then works
+    exactly like the old SearchFilter (view.search_fields with LIKE).
+    """
+    needs_sync = False
+
+    def rebuild(self):
+        return 0
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+
+def get_search_backend(vendor=None):
+    vendor = vendor or connection.vendor
+    if vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return LikeSearchBackend()
+
+
+@task
+def sync_search_index(product_id):
+    """
+    Makes the index entry of one product match the DB: added, updated or removed. Background task.
+    """
+    backend = get_search_backend()
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        backend.remove_product(product_id)
+    else:
+        backend.index_product(product)
+    product_version.bump()              # Search results cached before the index changed
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Drop-in for filters.SearchFilter (same ?search= param). Without ?ordering= the best matches come first.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        backend = get_search_backend()
+        if isinstance(backend, LikeSearchBackend):
+            return super().filter_queryset(request, queryset, view)
+
+        results = backend.search(queryset, terms)
+        if not results.exists():
+            # No word starts with the terms: substring match, like SearchFilter did before the index
+            return super().filter_queryset(request, queryset, view)
+
+        if filters.OrderingFilter.ordering_param not in request.query_params and 'search_rank' in results.query.annotations:
+            results = results.order_by('-search_rank', 'pk')
+        return results
@@ -1,22 +1,131 @@
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from api.models import Product
-from django.core.cache import cache
+from api.models import Product, User, Order, OrderItem
+from api.authentication import invalidate_user
+from api.cache import product_version, bump_order_versions
+from api.images import generate_renditions, needs_renditions
+from api.search import get_search_backend, sync_search_index
 
 """
 A Django signal is a way for one part of your application to notify 
 another part that something has happened, without the two parts being directly connected.
 In simple word: “When X happens, automatically do Y.”
 
-Here when we try to save/delete in Product (Model) throught DB then cache will be deleted [cache.delete_pattern('*product_list*')]
-Because when new product is added or some product is deleted then cached data is irrelavent.
+Here when we try to save/delete in Product (Model) throught DB then product caches become irrelavent.
+Before, we deleted them with cache.delete_pattern('*product_list*'). But in Redis that is a SCAN over
+the whole keyspace (slower as the cache grows, and it blocks Redis while running).
+Now we only bump the product version. All product cache keys contain the version,
+so the old entries are simply not used anymore and expire by their TTL. See api/cache.py
 """
 @receiver([post_save, post_delete], sender=Product)
 def invalidate_product_cache(sender, instance, **kwargs):
     """
-    Invalidate product list caches when a product is created, updated, or deleted
+    Invalidate product caches (list, detail, info) when a product is created, updated, or deleted
+    """
+    # Now AND after commit, like invalidate_order_cache: a GET between the two could cache the old row under the new version
+    product_version.bump()
+    transaction.on_commit(product_version.bump)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def index_product(sender, instance, **kwargs):
+    """
+    Keep the full-text search index in sync (only needed for SQLite FTS5). See api/search.py
+    Runs in the background worker after commit (api/tasks.py), not in the request.
+    Without a worker (TASK_BACKEND != 'database') it runs here, in the transaction of the write.
+    """
+    if not get_search_backend().needs_sync:
+        return
+    if getattr(settings, 'TASK_BACKEND', 'database') == 'database':
+        sync_search_index.delay(instance.pk)
+    else:
+        sync_search_index(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def process_product_image(sender, instance, **kwargs):
     """
-    print("Clearing product cache")
-    
-    # Clear product list caches
-    cache.delete_pattern('*product_list*')
\ No newline at end of file
+    New, changed or removed image: its renditions (thumbnails) are made by the background worker. See api/images.py
+    """
+    if needs_renditions(instance):
+        generate_renditions.delay(instance.pk)
+
+
+def invalidate_order_cache(user_id):
+    # Bumped now AND after commit: a request reading between the two could cache the
+    # not yet committed state under the first new version. The second bump makes that entry unused.
+    bump_order_versions([user_id])
+    transaction.on_commit(partial(bump_order_versions, [user_id]))
+
+
+order_user_ids = {}                     # Order id -> owner id, for item changes of an order that isn't loaded
+
+
+def remember_order_user_id(order_id, user_id):
+    if len(order_user_ids) >= 10000:
+        order_user_ids.clear()
+    order_user_ids[order_id] = user_id
+
+
+def get_order_user_id(order_id):
+    # The owner of an order doesn't change (OrderCreateSerializer: user is read only)
+    user_id = order_user_ids.get(order_id)
+    if user_id is None:
+        user_id = Order.objects.filter(pk=order_id).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            # Not None (the order may be created later) and only after commit: a rolled back order's id can be
+            # given to another user's order (SQLite)
+            transaction.on_commit(partial(remember_order_user_id, order_id, user_id))
+    return user_id
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_user_orders(sender, instance, **kwargs):
+    """
+    Cached order lists of the owner (and staff lists) become stale. See api/cache.py
+    """
+    invalidate_order_cache(instance.user_id)
+    if kwargs['signal'] is post_delete:
+        order_user_ids.pop(instance.pk, None)
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def invalidate_user_orders_on_item_change(sender, instance, origin=None, **kwargs):
+    # Deleting an order deletes its items too: the order's own signal is enough
+    if isinstance(origin, Order):
+        return
+    if OrderItem.order.is_cached(instance):
+        user_id = instance.order.user_id
+    else:
+        user_id = get_order_user_id(instance.order_id)
+    if user_id is not None:
+        invalidate_order_cache(user_id)
+
+
+def invalidate_user_on_commit(user_id):
+    # Now AND after commit, like invalidate_order_cache: a request between the two could cache the old user again
+    invalidate_user(user_id)
+    transaction.on_commit(partial(invalidate_user, user_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    Cached JWT users must see password / is_active / is_staff changes. See api/authentication.py
+    """
+    invalidate_user_on_commit(instance.pk)
+
+
+if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+    @receiver(post_save, sender=BlacklistedToken)
+    def invalidate_blacklisted_user_cache(sender, instance, **kwargs):
+        # e.g. a rotated refresh token (BLACKLIST_AFTER_ROTATION) or a logout: drop the user's cached tokens
+        if instance.token.user_id is not None:
+            invalidate_user_on_commit(instance.token.user_id)
@@ -0,0 +1,120 @@
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.db.models.functions import Now
+
+from api.cache import product_version
+from api.models import Order, Product
+
+"""
+Stock reservation.
+
+An order holds (reserves) the stock of its items while it is not cancelled.
+The naive way (read product.stock in Python, check it, save it) oversells: two checkouts read stock=1
+at the same time and both save stock=0. Here the check and the decrement are ONE conditional UPDATE
+done by the database:
+
+    UPDATE product SET stock = CASE WHEN id=1 THEN stock - 2 WHEN id=5 THEN stock - 1 END
+    WHERE (id=1 AND stock >= 2) OR (id=5 AND stock >= 1)
+
+If fewer rows than products were updated, one of them did not have enough stock, and the savepoint
+is rolled back. Before that, the rows are locked with SELECT ... FOR UPDATE in primary key order,
+so two checkouts with the same products always lock them in the same order (no deadlock).
+Releasing (cancel, smaller quantity) takes the same locks in the same order before its UPDATE.
+
+QuerySet.update() does not send post_save, so the product cache version is bumped here (after commit).
+It doesn't set auto_now fields either: updated_at (the product's ETag) is set in the same UPDATE.
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Insufficient stock for product(s): {', '.join(map(str, self.product_ids))}")
+
+
+def holds_stock(status):
+    return status != Order.StatusChoices.CANCELLED
+
+
+def get_quantities(items):
+    """
+    {product_id: total quantity} from OrderItem objects or validated item dicts.
+    """
+    quantities = Counter()
+    for item in items:
+        if isinstance(item, dict):
+            quantities[item['product'].pk] += item['quantity']
+        elif item.product_id is not None:           # Product deleted: no stock to give back
+            quantities[item.product_id] += item.quantity
+    return quantities
+
+
+def _stock_case(quantities, sign):
+    return Case(
+        *[When(pk=product_id, then=F('stock') + sign * quantity) for product_id, quantity in quantities.items()],
+        default=F('stock'),
+        output_field=IntegerField(),
+    )
+
+
+def lock_products(product_ids):
+    # Lock in a deterministic (pk) order to avoid deadlocks between concurrent checkouts / cancels
+    list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def reserve_stock(quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+
+    enough_stock = reduce(or_, (Q(pk=product_id, stock__gte=quantity) for product_id, quantity in quantities.items()))
+    try:
+        with transaction.atomic():
+            lock_products(quantities)
+
+            updated = Product.objects.filter(enough_stock).update(stock=_stock_case(quantities, -1), updated_at=Now())
+            if updated != len(quantities):
+                raise InsufficientStock(())         # Raising inside atomic() rolls back the rows that were decremented
+    except InsufficientStock:
+        in_stock = set(Product.objects.filter(enough_stock).values_list('pk', flat=True))
+        raise InsufficientStock(set(quantities) - in_stock)
+
+    transaction.on_commit(product_version.bump)
+
+
+def release_stock(quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    with transaction.atomic():
+        lock_products(quantities)
+        Product.objects.filter(pk__in=quantities).update(stock=_stock_case(quantities, 1), updated_at=Now())
+    transaction.on_commit(product_version.bump)
+
+
+def adjust_stock(old_quantities, new_quantities):
+    """
+    Reserve what is added, release what is removed. E.g. quantity 2 -> 5 reserves 3 more.
+    """
+    reserve = Counter(new_quantities)
+    reserve.subtract(old_quantities)
+
+    release_stock({product_id: -delta for product_id, delta in reserve.items() if delta < 0})
+    reserve_stock({product_id: delta for product_id, delta in reserve.items() if delta > 0})
+
+
+def lock_order(order):
+    """
+    Lock the order row and return its current status, so two requests can't cancel (release) it twice.
+    """
+    return Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+
+
+def update_order_stock(old_status, old_items, new_status, new_items):
+    old_quantities = get_quantities(old_items) if holds_stock(old_status) else {}
+    new_quantities = get_quantities(new_items) if holds_stock(new_status) else {}
+    adjust_stock(old_quantities, new_quantities)
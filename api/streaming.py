@@ -0,0 +1,99 @@
+import json
+
+from django.http import StreamingHttpResponse
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+"""
+Streaming responses for big (unpaginated) lists.
+
+Normally DRF builds the whole serializer.data list in memory and then renders it into one big bytes
+object. The client gets the first byte only after everything is done.
+With streaming the queryset is read with .iterator(chunk_size=...), serialized one chunk at a time and
+sent as soon as a chunk is ready. So peak memory depends on the chunk size, not on the number of rows.
+
+Ask for it with content negotiation:
+    Accept: application/x-ndjson        -> one JSON object per line (NDJSON)
+    ?format=jsonstream                  -> a normal JSON array, but streamed
+"""
+
+
+class NDJSONRenderer(JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Used when the response is not streamed (paginated page, detail, errors)
+        items = data if isinstance(data, list) else [data]
+        return b''.join(self.encode(item) + b'\n' for item in items)
+
+    def encode(self, item):
+        return json.dumps(item, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def stream(self, chunks):
+        for chunk in chunks:
+            yield b''.join(self.encode(item) + b'\n' for item in chunk)
+
+
+class JSONStreamRenderer(NDJSONRenderer):
+    media_type = 'application/json'
+    format = 'jsonstream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer.render(self, data, accepted_media_type, renderer_context)
+
+    def stream(self, chunks):
+        yield b'['
+        first = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            body = b','.join(self.encode(item) for item in chunk)
+            yield body if first else b',' + body
+            first = False
+        yield b']'
+
+
+class StreamingListMixin:
+    """
+    Add to a ListAPIView / ViewSet (before the DRF class). Unpaginated list requests that
+    negotiated a streaming renderer get a StreamingHttpResponse. Everything else works as before.
+    """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer, JSONStreamRenderer]
+    stream_chunk_size = 500
+
+    def is_streaming(self, request):
+        return getattr(request.accepted_renderer, 'streaming', False) and not self.is_paginated(request)
+
+    def is_paginated(self, request):
+        paginator = self.paginator
+        if paginator is None:
+            return False
+        if hasattr(paginator, 'is_requested'):          # KeysetPagination is opt-in
+            return paginator.is_requested(request)
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        renderer = request.accepted_renderer
+        return StreamingHttpResponse(
+            renderer.stream(self.serialize_chunks(queryset)),
+            content_type=f'{renderer.media_type}; charset=utf-8',
+        )
+
+    def serialize_chunks(self, queryset):
+        # prefetch_related() still works with iterator(): the prefetch runs once per chunk.
+        chunk = []
+        for instance in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(instance)
+            if len(chunk) == self.stream_chunk_size:
+                yield self.get_serializer(chunk, many=True).data
+                chunk = []
+        if chunk:
+            yield self.get_serializer(chunk, many=True).data
@@ -0,0 +1,197 @@
+import functools
+import logging
+import os
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+"""
+Background tasks: slow side effects of a write run after the response, in a worker process.
+
+    @task
+    def sync_search_index(product_id): ...
+
+    sync_search_index.delay(product.pk)         # In a view / signal handler: returns at once
+
+delay() runs nothing. When the current transaction commits (transaction.on_commit, right away outside of one)
+the task is handed to the TASK_BACKEND:
+    - 'database':  one Task row (api/models.py). `python manage.py run_tasks --processes 4` claims queued rows
+                   and runs them in a process pool. No broker: works with SQLite locally and in the tests.
+    - 'immediate': runs it in this process (still after commit). For development without a worker.
+A rolled back transaction enqueues nothing, and a task never runs before the data it needs is committed.
+
+Arguments are stored as JSON: pass ids, not model instances, and load the row in the task
+(it may have changed or be gone when the task runs).
+
+A failing task is retried up to max_attempts (TASK_MAX_ATTEMPTS) times, TASK_RETRY_DELAY * 2^(attempt - 1) seconds apart.
+Then its row stays with status 'Failed' and the traceback in last_error.
+A task running longer than TASK_TIMEOUT (worker killed, machine gone) is queued again by the next poll.
+So a task can run more than once: tasks must be idempotent ("make the index match the product", not "add 1").
+"""
+
+logger = logging.getLogger(__name__)
+
+registry = {}                                   # Task name -> TaskFunction
+
+
+class TaskFunction:
+    def __init__(self, func, name=None, max_attempts=None):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = name or f'{func.__module__}.{func.__qualname__}'
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)       # Runs it now, here
+
+    def delay(self, *args, **kwargs):
+        enqueue(self.name, args, kwargs)
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """
+    Decorator: @task or @task(max_attempts=5). The name defaults to 'module.function'.
+    """
+    def decorator(func):
+        task_function = TaskFunction(func, name, max_attempts)
+        registry[task_function.name] = task_function
+        return task_function
+    return decorator(func) if func is not None else decorator
+
+
+def get_task(name):
+    if name not in registry:
+        import_string(name)                     # Importing its module registers the task (worker processes)
+    return registry[name]
+
+
+def enqueue(name, args=(), kwargs=None, using=None):
+    transaction.on_commit(partial(push, name, list(args), kwargs or {}), using=using)
+
+
+def push(name, args, kwargs):
+    get_task_backend().push(get_task(name), args, kwargs)
+
+
+class DatabaseTaskBackend:
+    def push(self, task_function, args, kwargs):
+        from api.models import Task
+        Task.objects.create(
+            name=task_function.name, args=args, kwargs=kwargs, run_after=timezone.now(),
+            max_attempts=task_function.max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 3),
+        )
+
+
+class ImmediateTaskBackend:
+    def push(self, task_function, args, kwargs):
+        try:
+            task_function(*args, **kwargs)
+        except Exception:
+            # The data is committed: a failing side effect must not turn the response into a 500
+            logger.exception('Task %s failed', task_function.name)
+
+
+def get_task_backend():
+    backend = getattr(settings, 'TASK_BACKEND', 'database')
+    if backend == 'immediate':
+        return ImmediateTaskBackend()
+    return DatabaseTaskBackend()
+
+
+def make_worker_id():
+    return f'{socket.gethostname()[:40]}:{os.getpid()}'
+
+
+def requeue_stale(now):
+    """
+    Running tasks of a worker that died: queued again, or failed when they used all their attempts.
+    """
+    from api.models import Task
+    stale = Task.objects.filter(
+        status=Task.StatusChoices.RUNNING,
+        locked_at__lt=now - timedelta(seconds=getattr(settings, 'TASK_TIMEOUT', 300)),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.StatusChoices.FAILED, last_error='Timed out (worker stopped?)',
+    )
+    return failed + stale.update(status=Task.StatusChoices.QUEUED, run_after=now, locked_at=None, locked_by='')
+
+
+def claim_tasks(limit, worker_id):
+    """
+    Marks up to `limit` ready tasks as running for this worker and returns their ids (oldest first).
+    """
+    from api.models import Task
+    now = timezone.now()
+    requeue_stale(now)
+
+    queued = Task.objects.filter(status=Task.StatusChoices.QUEUED)
+    task_ids = list(queued.filter(run_after__lte=now).order_by('run_after', 'pk').values_list('pk', flat=True)[:limit])
+    if not task_ids:
+        return []
+
+    # Conditional UPDATE: when two workers read the same ids, each row is only claimed by one of them
+    lock = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+    queued.filter(pk__in=task_ids).update(
+        status=Task.StatusChoices.RUNNING, locked_at=now, locked_by=lock, attempts=F('attempts') + 1,
+    )
+    return list(Task.objects.filter(pk__in=task_ids, locked_by=lock).order_by('run_after', 'pk').values_list('pk', flat=True))
+
+
+def run_task(task_id):
+    """
+    Runs one claimed task. Returns 'done', 'retry', 'failed' or None (no longer ours).
+    """
+    from api.models import Task
+    row = Task.objects.filter(pk=task_id, status=Task.StatusChoices.RUNNING).first()
+    if row is None:
+        return None
+    try:
+        get_task(row.name)(*row.args, **row.kwargs)
+    except Exception:
+        return retry_or_fail(row, traceback.format_exc())
+    row.delete()
+    return 'done'
+
+
+def retry_or_fail(row, error):
+    from api.models import Task
+    update = {'last_error': error, 'locked_at': None, 'locked_by': ''}
+    if row.attempts >= row.max_attempts:
+        logger.error('Task %s (%s) failed after %s attempts:\n%s', row.pk, row.name, row.attempts, error)
+        Task.objects.filter(pk=row.pk).update(status=Task.StatusChoices.FAILED, **update)
+        return 'failed'
+
+    delay = getattr(settings, 'TASK_RETRY_DELAY', 10) * 2 ** (row.attempts - 1)
+    logger.warning('Task %s (%s) failed, retry in %ss:\n%s', row.pk, row.name, delay, error)
+    Task.objects.filter(pk=row.pk).update(
+        status=Task.StatusChoices.QUEUED, run_after=timezone.now() + timedelta(seconds=delay), **update,
+    )
+    return 'retry'
+
+
+def run_pooled_task(task_id):
+    # Pool processes live long: like around a request, drop broken / too old DB connections
+    close_old_connections()
+    try:
+        return run_task(task_id)
+    finally:
+        close_old_connections()
+
+
+def init_worker(initializer=None, *args):
+    # Pool process started with 'spawn': a new interpreter, it sets Django up itself
+    # (same DJANGO_SETTINGS_MODULE and sys.path as the parent). It shares no DB connection with the parent.
+    # `initializer`: dotted path of a function to call next, imported only now (its module may import models)
+    import django
+    django.setup()
+    if initializer is not None:
+        import_string(initializer)(*args)
@@ -1,9 +1,49 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, OperationalError
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from api.models import Order, User
+from api.authentication import CachedJWTAuthentication, local_tokens, user_cache_key
+from api.cache import order_list_cache, product_list_cache, product_version
+from api.images import make_renditions
+from api.filters import ProductFilter, OrderFilter, InStockFilterBackend
+from api.fast_serializers import FastProductSerializer, FastOrderItemSerializer, FastOrderSerializer
+from api.metrics import Histogram, metrics, silk_intercept
+from api.models import Order, OrderItem, User, Product, Task
+from api.query_budget import QUERY_COUNT_HEADER, QueryBudgetTestMixin, QueryBudgetExceeded, get_query_budget, is_counted
+from api.search import get_search_backend
+from api.serializers import OrderCreateSerializer, ProductSerializer, OrderItemSerializer, OrderSerializer
+from api.signals import get_order_user_id, order_user_ids
+from api.stock import release_stock, reserve_stock
+from api.tasks import claim_tasks, run_task, task
+from api.throttles import CacheGCRAStore, RedisGCRAStore, ScopedRateThrottle, GCRA_SCRIPT
+from api import views
+from api.views import OrderViewSet
 
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
 
 # Create your tests here.
 class UserOrderTestCase(TestCase):
@@ -19,12 +59,1497 @@ class UserOrderTestCase(TestCase):
     def test_user_order_endpoint_retrieves_only_authenticated_user_orders(self):
         user = User.objects.get(username='user2')
         self.client.force_login(user)
-        response = self.client.get(reverse('user-orders'))
+        response = self.client.get(reverse('order-user-orders'))
 
         assert response.status_code == status.HTTP_200_OK
         orders = response.json()
         self.assertTrue(all(order['user'] == user.id for order in orders))
 
     def test_user_order_list_unauthenticated(self):
-        response = self.client.get(reverse('user-orders'))
+        response = self.client.get(reverse('order-user-orders'))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal(i % 3 + 1), stock=1)
+            for i in range(11)
+        ])
+        self.user = User.objects.create_user(username='user1', password='test')
+        for _ in range(7):
+            Order.objects.create(user=self.user)
+
+    def walk(self, url, data=None):
+        names, pages = [], 0
+        while url:
+            page = self.client.get(url, data).json()
+            names += [product['name'] for product in page['results']]
+            url, data = page['next'], None              # The next link has every param
+            pages += 1
+        return names, pages
+
+    def test_product_list_is_not_paginated_by_default(self):
+        response = self.client.get(reverse('product-list'))
+        self.assertEqual(len(response.json()), 11)
+
+    def test_product_pages_cover_every_row_once(self):
+        names, pages = self.walk(reverse('product-list'), data={'page_size': 4})
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, list(Product.objects.order_by('pk').values_list('name', flat=True)))
+
+    def test_product_pages_follow_ordering_filter_with_pk_tiebreaker(self):
+        names, _ = self.walk(reverse('product-list'), data={'page_size': 2, 'ordering': '-price'})
+        expected = Product.objects.order_by('-price', 'pk').values_list('name', flat=True)
+        self.assertEqual(names, list(expected))
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get(reverse('product-list'), data={'page_size': 4}).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_tampered_cursor_is_rejected(self):
+        first = self.client.get(reverse('product-list'), data={'page_size': 4}).json()
+        response = self.client.get(first['next'].replace('cursor=', 'cursor=x'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_pages_are_sorted_by_created_at_and_order_id(self):
+        self.client.force_login(self.user)
+        url, data, order_ids = reverse('order-list'), {'page_size': 3}, []
+        while url:
+            page = self.client.get(url, data).json()
+            order_ids += [order['order_id'] for order in page['results']]
+            url, data = page['next'], None
+
+        expected = Order.objects.order_by('created_at', 'order_id').values_list('order_id', flat=True)
+        self.assertEqual(order_ids, [str(order_id) for order_id in expected])
+
+
+class ProductListCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.create(name='Television', description='test', price=Decimal('10.00'), stock=3)
+
+    def test_equivalent_queries_share_one_cache_entry(self):
+        before = product_list_cache.stats()
+        first = self.client.get('/api/products/?price__gt=5&name__icontains=tele')
+        second = self.client.get('/api/products/?name__icontains=tele&price__gt=5.00')
+        after = product_list_cache.stats()
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_invalid_filter_is_not_cached(self):
+        response = self.client.get('/api/products/?price__gt=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductCacheVersionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Television', description='test', price=Decimal('10.00'), stock=3)
+
+    def test_product_write_bumps_version(self):
+        version = product_version.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+            self.assertEqual(product_version.get(), version + 1)
+        # Again after commit: an entry cached from the old row between the save and the commit is not used
+        self.assertEqual(product_version.get(), version + 2)
+
+    def test_cached_product_responses_are_fresh_after_write(self):
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))     # Not anon throttled
+        detail_url = f'/api/products/{self.product.pk}/'
+        for url in ('/api/products/', detail_url, '/api/products/info/'):
+            self.client.get(url)            # Warm up the cache
+
+        self.product.name = 'Radio'
+        self.product.save()
+
+        self.assertEqual(self.client.get('/api/products/').json()[0]['name'], 'Radio')
+        self.assertEqual(self.client.get(detail_url).json()['name'], 'Radio')
+        self.assertEqual(self.client.get('/api/products/info/').json()['products'][0]['name'], 'Radio')
+
+
+class OrderTotalsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.tv = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=5)
+        self.radio = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=5)
+        self.client.force_login(self.user)
+
+    def create_order(self):
+        response = self.client.post(reverse('order-list'), {
+            'status': 'Pending',
+            'items': [
+                {'product': self.tv.pk, 'quantity': 1},
+                {'product': self.radio.pk, 'quantity': 2},
+            ]
+        }, content_type='application/json')
+        return Order.objects.get(pk=response.json()['order_id'])
+
+    def test_totals_are_stored_on_create_and_update(self):
+        order = self.create_order()
+        self.assertEqual(order.total_price, Decimal('325.00'))
+        self.assertEqual(order.item_count, 2)
+
+        self.client.put(reverse('order-detail', args=[order.pk]), {
+            'status': 'Pending',
+            'items': [{'product': self.radio.pk, 'quantity': 4}],
+        }, content_type='application/json')
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('50.00'))
+        self.assertEqual(order.item_count, 1)
+
+    def test_backfill_order_totals_command(self):
+        order = self.create_order()
+        Order.objects.update(total_price=0, item_count=0)
+        self.assertEqual(self.client.get(reverse('order-list')).json()[0]['total_price'], 0.0)     # Cached
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('backfill_order_totals', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('325.00'))
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(self.client.get(reverse('order-list')).json()[0]['total_price'], 325.0)   # Cache invalidated
+
+    def test_deleting_a_product_keeps_order_lines_and_totals(self):
+        order = self.create_order()
+
+        self.client.force_login(User.objects.create_superuser(username='admin', password='test'))
+        self.assertEqual(self.client.delete(f'/api/products/{self.tv.pk}/').status_code, status.HTTP_204_NO_CONTENT)
+        order.refresh_from_db()
+        self.assertEqual((order.total_price, order.item_count), (Decimal('325.00'), 2))
+        self.assertEqual(list(order.items.order_by('product_name').values_list('product', 'product_name')),
+                         [(self.radio.pk, 'Radio'), (None, 'Television')])
+
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('order-list')).json()
+        self.assertEqual(sorted(item['product_name'] for item in data[0]['items']), ['Radio', 'Television'])
+
+        url = reverse('order-detail', args=[order.pk])
+        response = self.client.patch(url, {'status': Order.StatusChoices.CANCELLED}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.radio.refresh_from_db()
+        self.assertEqual(self.radio.stock, 5)                   # Stock of the remaining product given back
+
+    def test_summary_does_not_load_items(self):
+        self.create_order()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order-summary'))
+        self.assertFalse([q for q in queries if 'api_orderitem' in q['sql'] or 'api_product' in q['sql']])
+        self.assertEqual(response.json()[0]['total_price'], 325.0)
+
+    def test_repricing_a_product_keeps_old_orders(self):
+        order = self.create_order()
+        self.tv.name, self.tv.price = 'Television 2', Decimal('999.00')
+        self.tv.save()
+
+        item = self.client.get(reverse('order-detail', args=[order.pk])).json()['items'][0]
+        self.assertEqual((item['product_name'], item['product_price']), ('Television', '300.00'))
+
+        # Changing the quantity of an ordered item keeps its price, a new item gets today's price
+        self.client.put(reverse('order-detail', args=[order.pk]), {
+            'status': 'Pending',
+            'items': [{'product': self.tv.pk, 'quantity': 2}, {'product': self.radio.pk, 'quantity': 2}],
+        }, content_type='application/json')
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('625.00'))
+        self.assertEqual(self.create_order().total_price, Decimal('1024.00'))
+
+        call_command('backfill_order_totals', stdout=StringIO())
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('625.00'))
+
+    def test_order_reads_do_not_query_products(self):
+        order = self.create_order()
+        for path in (reverse('order-list'), reverse('order-detail', args=[order.pk]), reverse('order-user-orders')):
+            cache.clear()
+            self.client.force_login(self.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse([q for q in queries if 'api_product' in q['sql']])
+
+
+class OrderBulkWriteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal('1.00'), stock=100)
+            for i in range(30)
+        ])
+        self.client.force_login(self.user)
+
+    def count_queries(self, method, url, items):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(url, {'status': 'Pending', 'items': items}, content_type='application/json')
+        self.assertLess(response.status_code, 300)
+        api_queries = [q for q in queries if 'silk_' not in q['sql']]      # Ignore profiler writes
+        return response, len(api_queries)
+
+    def test_create_query_count_does_not_grow_with_cart_size(self):
+        small = [{'product': p.pk, 'quantity': 1} for p in self.products[:2]]
+        large = [{'product': p.pk, 'quantity': 1} for p in self.products]
+
+        _, small_count = self.count_queries(self.client.post, reverse('order-list'), small)
+        _, large_count = self.count_queries(self.client.post, reverse('order-list'), large)
+        self.assertEqual(small_count, large_count)
+
+    def test_update_applies_only_the_difference(self):
+        items = [{'product': p.pk, 'quantity': 1} for p in self.products[:3]]
+        response, _ = self.count_queries(self.client.post, reverse('order-list'), items)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        kept = order.items.get(product=self.products[0])
+
+        items = [
+            {'product': self.products[0].pk, 'quantity': 1},        # unchanged
+            {'product': self.products[1].pk, 'quantity': 5},        # updated
+            {'product': self.products[5].pk, 'quantity': 2},        # added. products[2] is removed
+        ]
+        self.count_queries(self.client.put, reverse('order-detail', args=[order.pk]), items)
+
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity')),
+            sorted([(self.products[0].pk, 1), (self.products[1].pk, 5), (self.products[5].pk, 2)])
+        )
+        self.assertTrue(order.items.filter(pk=kept.pk).exists())        # Same row, not recreated
+
+    def test_unknown_product_is_rejected(self):
+        response = self.client.post(reverse('order-list'), {
+            'status': 'Pending',
+            'items': [{'product': 999999, 'quantity': 1}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.tv = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=3)
+        self.radio = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=1)
+        self.client.force_login(self.user)
+
+    def order(self, *items):
+        return self.client.post(reverse('order-list'), {
+            'status': 'Pending',
+            'items': [{'product': product.pk, 'quantity': quantity} for product, quantity in items],
+        }, content_type='application/json')
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def test_order_reserves_stock(self):
+        self.order((self.tv, 2), (self.radio, 1))
+        self.assertEqual(self.stock(self.tv), 1)
+        self.assertEqual(self.stock(self.radio), 0)
+
+    def test_insufficient_stock_rejects_whole_order(self):
+        response = self.order((self.tv, 2), (self.radio, 2))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.radio.pk), response.json()['items'][0])
+        self.assertEqual(self.stock(self.tv), 3)                # Television decrement was rolled back
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_releases_and_update_adjusts_stock(self):
+        order_id = self.order((self.tv, 2)).json()['order_id']
+        url = reverse('order-detail', args=[order_id])
+
+        self.client.put(url, {'status': 'Pending', 'items': [{'product': self.tv.pk, 'quantity': 3}]}, content_type='application/json')
+        self.assertEqual(self.stock(self.tv), 0)
+
+        self.client.patch(url, {'status': Order.StatusChoices.CANCELLED}, content_type='application/json')
+        self.assertEqual(self.stock(self.tv), 3)
+
+    def test_stale_stock_value_does_not_oversell(self):
+        # Another checkout takes the last radio after this request loaded the product (stock=1)
+        serializer = OrderCreateSerializer(data={'status': 'Pending', 'items': [{'product': self.radio.pk, 'quantity': 1}]})
+        self.assertTrue(serializer.is_valid())
+        Product.objects.filter(pk=self.radio.pk).update(stock=0)
+
+        with self.assertRaises(ValidationError):
+            serializer.save(user=self.user)
+        self.assertEqual(self.stock(self.radio), 0)
+
+
+class ConcurrentCheckoutTestCase(TransactionTestCase):
+    attempts = 100                                      # Per checkout: bounded retries, never a hang
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=5)
+        user = User.objects.create_user(username='user1', password='test')
+        login = Client()
+        login.force_login(user)
+        results = []
+
+        def checkout():
+            client = Client()
+            client.cookies = login.cookies
+            try:
+                for _ in range(self.attempts):
+                    try:
+                        response = client.post(reverse('order-list'), {
+                            'status': 'Pending',
+                            'items': [{'product': product.pk, 'quantity': 1}],
+                        }, content_type='application/json')
+                        results.append(response.status_code)
+                        return
+                    except OperationalError:            # SQLite "database table is locked": try again a bit later
+                        time.sleep(random.uniform(0.01, 0.1))
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+
+        # A retry after a lock error on the response (order already committed) gets a 400: count the orders
+        product.refresh_from_db()
+        self.assertEqual(len(results), 20)
+        self.assertLessEqual(set(results), {status.HTTP_201_CREATED, status.HTTP_400_BAD_REQUEST})
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(product.stock, 0)
+
+    def test_release_locks_the_products(self):
+        product = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=5)
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            release_stock({product.pk: 2})
+        sql = [q['sql'] for q in queries if is_counted(q['sql'])]
+        self.assertEqual([s.split()[0] for s in sql], ['SELECT', 'UPDATE'])    # SELECT ... FOR UPDATE on PostgreSQL
+        self.assertIn('ORDER BY', sql[0])
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+
+class ProductInfoTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal(i), stock=1)
+            for i in range(1, 13)
+        ])
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))
+
+    def test_info_returns_aggregates_and_one_page(self):
+        data = self.client.get('/api/products/info/').json()
+        self.assertEqual(data['count'], 12)
+        self.assertEqual(data['max_price'], 12.0)
+        self.assertEqual(len(data['products']), 5)           # PAGE_SIZE
+        self.assertIsNotNone(data['next'])
+
+    def test_aggregates_are_cached_until_product_write(self):
+        self.client.get('/api/products/info/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/products/info/')
+        self.assertFalse([q for q in queries if 'MAX(' in q['sql']])
+
+        Product.objects.create(name='Expensive', description='test', price=Decimal('99.00'), stock=1)
+        self.assertEqual(self.client.get('/api/products/info/').json()['max_price'], 99.0)
+
+
+class StreamingListTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        product = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=50)
+        Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=5)
+        for _ in range(3):
+            order = Order.objects.create(user=self.user)
+            order.items.create(product=product, quantity=2)
+        self.client.force_login(self.user)
+
+    def read_stream(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_stream_matches_regular_list(self):
+        for url in ('/api/products/', reverse('order-list'), '/api/users/'):
+            expected = self.client.get(url).json()
+            response = self.client.get(url, HTTP_ACCEPT='application/x-ndjson')
+
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+            lines = self.read_stream(response).decode().splitlines()
+            self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_json_array_stream_in_small_chunks(self):
+        expected = self.client.get(reverse('order-list')).json()
+        with mock.patch.object(OrderViewSet, 'stream_chunk_size', 2):
+            response = self.client.get(reverse('order-list') + '?format=jsonstream')
+        self.assertEqual(json.loads(self.read_stream(response)), expected)
+
+    def test_paginated_request_is_not_streamed(self):
+        response = self.client.get('/api/products/?page_size=1', HTTP_ACCEPT='application/x-ndjson')
+        self.assertFalse(response.streaming)
+
+
+class AsyncViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        other = User.objects.create_user(username='user2', password='test')
+        self.product = Product.objects.create(name='Television', description='test', price=Decimal('300.00'), stock=50)
+        Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=5)
+        for user in (self.user, self.user, other):
+            order = Order.objects.create(user=user)
+            order.items.create(product=self.product, quantity=2)
+        self.order = order
+        self.client.force_login(self.user)
+
+    async def test_async_product_endpoints_match_sync(self):
+        await self.async_client.aforce_login(self.user)
+        for path in ('products/', 'products/?ordering=-price', 'products/?page_size=1',
+                     f'products/{self.product.pk}/', 'products/info/'):
+            await cache.aclear()
+            expected = (await self.async_client.get(f'/api/{path}')).json()
+            await cache.aclear()
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), JSONRenderer().render(expected))
+
+    async def test_async_product_errors(self):
+        await self.async_client.aforce_login(self.user)
+        self.assertEqual((await self.async_client.get('/api/async/products/999/')).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.async_client.get('/api/async/products/?price__gt=abc')).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((await self.async_client.post('/api/async/orders/')).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_async_product_list_uses_cache(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get('/api/async/products/')
+        await Product.objects.filter(pk=self.product.pk).aupdate(name='Renamed')   # No signal, cache is not bumped
+        data = (await self.async_client.get('/api/async/products/')).json()
+        self.assertEqual(data[0]['name'], 'Television')
+
+    async def test_async_orders_require_auth_and_are_scoped_to_user(self):
+        response = await self.async_client.get('/api/async/orders/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        await self.async_client.aforce_login(self.user)
+        expected = (await self.async_client.get(reverse('order-list'))).json()
+        data = (await self.async_client.get('/api/async/orders/')).json()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data, expected)
+
+        response = await self.async_client.get(f'/api/async/orders/{self.order.pk}/')        # Other user's order
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_order_pages(self):
+        first = self.client.get('/api/async/orders/?page_size=1').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 2)
+        self.assertIsNone(second['next'])
+
+
+class FastReadSerializerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal(f'{i}.{i}5'), stock=i)
+            for i in range(1, 6)
+        ])
+        for i in range(4):
+            order = Order.objects.create(user=self.user, total_price=Decimal('10.10') * i)
+            for product in products[i:]:
+                order.items.create(product=product, quantity=i + 1)
+        Order.objects.create(user=self.user)        # Order without items
+
+    def assertSameOutput(self, serializer_class, fast_serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(fast_serializer_class(queryset, many=True).data), expected)
+
+    def test_output_is_byte_identical(self):
+        self.assertSameOutput(ProductSerializer, FastProductSerializer, Product.objects.order_by('-price'))
+        self.assertSameOutput(OrderItemSerializer, FastOrderItemSerializer, OrderItem.objects.order_by('pk'))
+        self.assertSameOutput(OrderSerializer, FastOrderSerializer, Order.objects.prefetch_related('items__product').order_by('created_at'))
+
+    @override_settings(FAST_READ_SERIALIZERS=True)
+    def test_views_use_fast_serializer_when_enabled(self):
+        self.client.force_login(self.user)
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            expected = self.client.get(reverse('order-list')).content
+        cache.clear()
+        with mock.patch.object(FastOrderSerializer, 'to_representation', autospec=True,
+                               side_effect=FastOrderSerializer.to_representation) as fast_path:
+            content = self.client.get(reverse('order-list')).content
+        self.assertTrue(fast_path.called)
+        self.assertEqual(content, expected)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class IndexUsageTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='test')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+
+    def test_in_stock_products_by_price(self):
+        products = ProductFilter({'price__lt': '100', 'price__gt': '5'}, queryset=Product.objects.all()).qs
+        products = InStockFilterBackend().filter_queryset(None, products, None).order_by('price')
+        self.assertUsesIndex(products, 'product_in_stock_price_idx')
+
+    def test_user_orders_by_created_at(self):
+        orders = OrderFilter({'created_at': '2026-01-12'}, queryset=Order.objects.filter(user=self.user)).qs
+        self.assertUsesIndex(orders, 'order_user_created_idx')
+        self.assertIn('created_at>? AND created_at<?', orders.explain().replace('"', ''))   # Range, not DATE(created_at)
+
+    def test_orders_by_status(self):
+        orders = OrderFilter({'status': 'Pending'}, queryset=Order.objects.all()).qs
+        self.assertUsesIndex(orders, 'order_status_created_idx')
+
+    def test_created_at_date_filter_matches_whole_day(self):
+        order = Order.objects.create(user=self.user)
+        day = timezone.localtime(order.created_at).date()
+        for value, expected in ((day, 1), (day + datetime.timedelta(days=1), 0), (day - datetime.timedelta(days=1), 0)):
+            orders = OrderFilter({'created_at': value.isoformat()}, queryset=Order.objects.all()).qs
+            self.assertEqual(orders.count(), expected)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Uses the SQLite FTS5 index')
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tv = Product.objects.create(name='Television', description='An amazing new TV', price=Decimal('300.00'), stock=4)
+            self.radio = Product.objects.create(name='Radio', description='Old style radio, not a television', price=Decimal('20.00'), stock=4)
+            Product.objects.create(name='Coffee Machine', description='Makes coffee', price=Decimal('70.99'), stock=4)
+        self.run_tasks()
+
+    def run_tasks(self):
+        call_command('run_tasks', '--burst', stdout=StringIO())        # The index is updated by the worker
+
+    def search(self, term):
+        return [product['name'] for product in self.client.get('/api/products/', {'search': term}).json()]
+
+    def search_index(self, term):
+        return list(get_search_backend().search(Product.objects.all(), [term]).values_list('name', flat=True))
+
+    def test_prefix_search_ranks_best_match_first(self):
+        self.assertEqual(self.search('televi'), ['Television', 'Radio'])
+        self.assertEqual(self.search('coffee machine'), ['Coffee Machine'])
+
+    def test_search_input_is_not_fts_syntax(self):
+        self.assertEqual(self.search('"NEAR( OR -'), [])
+
+    def test_substring_search_when_no_prefix_matches(self):
+        self.assertEqual(self.search('mazing'), ['Television'])               # LIKE on search_fields
+        self.assertEqual(self.search('tyle'), ['Radio'])
+
+    @override_settings(TASK_BACKEND='immediate')
+    def test_index_is_synced_in_the_request_without_worker(self):
+        self.radio.description = 'Old style radio'
+        self.radio.save()
+        self.tv.delete()
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(self.search('television'), [])
+
+    def test_index_follows_product_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.radio.description = 'Old style radio'
+            self.radio.save()
+            self.tv.delete()
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(self.search('television'), ['Radio'])         # Not indexed yet (and now cached)
+        self.run_tasks()
+        self.assertEqual(self.search('television'), [])
+        self.assertFalse(Task.objects.exists())
+
+    def test_rebuild_search_index_command(self):
+        Product.objects.bulk_create([Product(name='Walkman', description='Cassette player', price=Decimal('9.99'), stock=1)])
+        self.assertEqual(self.search_index('walkman'), [])           # bulk_create skips signals
+        self.assertEqual(self.search('walkman'), ['Walkman'])         # Found by the substring fallback
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search_index('walkman'), ['Walkman'])
+
+
+class FakeRedis:
+    """
+    Just enough of the redis client to check what RedisGCRAStore sends (no Lua interpreter here).
+    """
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def register_script(self, script):
+        self.script = script
+
+        def run(keys, args):
+            self.calls.append((keys, args))
+            return self.result
+        return run
+
+
+class GCRAThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        self.store = CacheGCRAStore(timer=lambda: self.now)
+
+    def test_burst_then_one_per_interval(self):
+        self.assertEqual([self.store.hit('key', 2, 60) for _ in range(2)], [0, 0])
+        self.assertEqual(self.store.hit('key', 2, 60), 30)         # Wait for the next free slot
+        self.now += 30
+        self.assertEqual(self.store.hit('key', 2, 60), 0)
+        self.assertEqual(self.store.hit('key', 2, 60), 30)
+        self.assertIsInstance(cache.get('key'), float)              # One number, not a list of timestamps
+
+    def test_anon_throttle_returns_retry_after(self):
+        product = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=5)
+        responses = [self.client.get(f'/api/products/{product.pk}/') for _ in range(3)]     # anon: 2/minute
+        self.assertEqual([r.status_code for r in responses], [200, 200, status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(responses[-1]['Retry-After'], '30')
+
+    def test_scoped_throttle_uses_view_scope(self):
+        view = mock.Mock(throttle_scope='orders')                   # 'orders': '4/minute'
+        request = Request(APIRequestFactory().get('/'), authenticators=())
+        results = [ScopedRateThrottle().allow_request(request, view) for _ in range(5)]
+        self.assertEqual(results, [True] * 4 + [False])
+        self.assertTrue(cache.get('throttle_gcra_orders_127.0.0.1'))
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'product': '2/minute'},
+    })
+    def test_product_list_uses_product_scope(self):
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))     # Not anon throttled
+        responses = [self.client.get('/api/products/') for _ in range(3)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(responses[-1]['Retry-After'], '30')
+        self.assertEqual(self.client.get('/api/orders/').status_code, 200)                        # Other scope
+
+    def test_product_scope_allows_regular_use(self):
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))
+        responses = [self.client.get('/api/products/') for _ in range(10)]
+        self.assertEqual({r.status_code for r in responses}, {status.HTTP_200_OK})
+
+    def test_redis_store_is_one_script_call(self):
+        client = FakeRedis(result=1500)
+        store = RedisGCRAStore(client, cache)
+        self.assertEqual(client.script, GCRA_SCRIPT)
+        self.assertEqual(store.hit('throttle_gcra_anon_1', 2, 60), 1.5)
+        self.assertEqual(client.calls, [([cache.make_key('throttle_gcra_anon_1')], [60000, 30000.0])])
+
+
+class ProductImportExportTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def import_products(self, path, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_products', path, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_import_upserts_on_sku_and_skips_invalid_rows(self):
+        Product.objects.create(sku='TV-1', name='Old TV', description='old', price=Decimal('1.00'), stock=1)
+        path = self.write_file('catalog.csv', (
+            'sku,name,description,price,stock\n'
+            'TV-1,Television,An amazing new TV,300.00,4\n'
+            'RADIO-1,Radio,Old style radio,20.00,10\n'
+            'FREE-1,Free thing,Nothing,0,1\n'                 # validate_price: must be > 0
+            ',No sku,Nothing,5.00,1\n'
+            'RADIO-1,Radio,Old style radio,25.00,8\n'          # Same sku again: last row wins
+        ))
+        stdout, stderr = self.import_products(path, batch_size=2)
+
+        self.assertIn('Invalid rows: 2', stdout)
+        self.assertIn('Line 4', stderr)
+        self.assertIn('Price must be grater than 0.', stderr)
+        self.assertEqual(
+            list(Product.objects.order_by('sku').values_list('sku', 'name', 'price', 'stock')),
+            [('RADIO-1', 'Radio', Decimal('25.00'), 8), ('TV-1', 'Television', Decimal('300.00'), 4)],
+        )
+
+    def test_ndjson_lines_that_are_not_objects_are_invalid_rows(self):
+        path = self.write_file('catalog.ndjson', (
+            '5\nnull\ntrue\n["__error__"]\n{not json\n'
+            '{"sku": "TV-1", "name": "Television", "description": "TV", "price": "300.00", "stock": 4}\n'
+        ))
+        stdout, stderr = self.import_products(path)
+        self.assertIn('Invalid rows: 5', stdout)
+        self.assertEqual(stderr.count('Expected an object.'), 4)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['TV-1'])
+
+    def test_import_invalidates_caches(self):
+        self.assertEqual(self.client.get('/api/products/').json(), [])
+        path = self.write_file('catalog.ndjson', '{"sku": "TV-1", "name": "Television", "description": "TV", "price": "300.00", "stock": 4}\n')
+        self.import_products(path)
+        self.assertEqual([product['name'] for product in self.client.get('/api/products/').json()], ['Television'])
+
+    def test_export_import_round_trip(self):
+        Product.objects.create(sku='TV-1', name='Télévision', description='Line 1\nLine 2', price=Decimal('300.00'), stock=4)
+        Product.objects.create(sku='RADIO-1', name='Radio, "old"', description='radio', price=Decimal('20.50'), stock=0)
+        expected = list(Product.objects.order_by('sku').values_list('sku', 'name', 'description', 'price', 'stock'))
+
+        for name in ('catalog.csv', 'catalog.ndjson'):
+            path = os.path.join(self.directory.name, name)
+            call_command('export_products', path, stdout=StringIO())
+            Product.objects.all().delete()
+            self.import_products(path)
+            self.assertEqual(list(Product.objects.order_by('sku').values_list('sku', 'name', 'description', 'price', 'stock')), expected)
+
+
+class GenerateDataTestCase(TestCase):
+    def generate(self, *args):
+        call_command('generate_data', '--users', '5', '--products', '20', '--orders', '30', '--chunk-size', '7', *args, stdout=StringIO())
+        orders = Order.objects.filter(user__username__startswith='loadtest_').annotate(**Order.totals_annotation())
+        return [
+            (order.order_id, order.user.username, order.created_at, order.status, order.total_price, order.item_count,
+             order.computed_total_price, order.computed_item_count,
+             [(item.product.sku, item.quantity) for item in order.items.order_by('product__sku')])
+            for order in orders.order_by('order_id')
+        ]
+
+    def test_same_seed_gives_same_dataset(self):
+        first = self.generate()
+        self.assertEqual(len(first), 30)
+        for *_, total_price, item_count, computed_total_price, computed_item_count, items in first:
+            self.assertEqual((total_price, item_count), (computed_total_price, computed_item_count))
+            self.assertEqual(item_count, len(items))
+        self.assertTrue(all(created_at < datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) for _, _, created_at, *_ in first))
+
+        with self.assertRaises(CommandError):
+            self.generate()                                     # Needs --flush
+        self.assertEqual(self.generate('--flush'), first)
+        self.assertNotEqual(self.generate('--flush', '--seed', '7'), first)
+
+
+class BenchmarkApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='admin', password='test')
+        product = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=100)
+        Order.objects.create(user=user).items.create(product=product, quantity=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'results.json')
+
+    def benchmark(self, *args):
+        call_command('benchmark_api', '--requests', '3', '--warmup', '0', *args, stdout=StringIO())
+
+    def test_results_are_saved_and_writes_rolled_back(self):
+        self.benchmark('--output', self.output)
+        with open(self.output) as file:
+            report = json.load(file)
+
+        self.assertEqual(Order.objects.count(), 1)                  # order_create was rolled back
+        self.assertEqual(Product.objects.get().stock, 100)
+        for name in ('products_list', 'products_search', 'product_detail', 'products_info', 'orders_list',
+                     'user_orders', 'order_detail', 'order_create'):
+            result = report['results'][name]
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 3)
+            self.assertIsNotNone(result['queries'])                 # 0 for cached responses (the JWT user is cached too)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreaterEqual(report['results']['order_create']['queries'], 1)
+
+    def test_compare_fails_on_more_queries(self):
+        self.benchmark('--output', self.output, '--only', 'order_detail')
+        with open(self.output) as file:
+            report = json.load(file)
+        report['results']['order_detail']['queries'] -= 1
+        with open(self.output, 'w') as file:
+            json.dump(report, file)
+
+        with self.assertRaisesMessage(CommandError, 'order_detail: queries'):
+            self.benchmark('--only', 'order_detail', '--compare', self.output, '--threshold', '100')
+
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """
+    Every endpoint must run the same number of queries with 10 and with 1000 orders (no N+1),
+    and stay within its view's query_budget (the mixin makes a request over budget raise).
+    """
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal('1.00'), stock=10000)
+            for i in range(10)
+        ])
+
+    def add_data(self, count):
+        # Orders of self.user and of other users, 2 items each. Also more products and users.
+        users = User.objects.bulk_create([User(username=f'other{User.objects.count()}_{i}') for i in range(count // 10)])
+        orders = Order.objects.bulk_create([
+            Order(user=self.user if i % 2 else users[i % len(users)], item_count=2, total_price=Decimal('2.00'))
+            for i in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem.for_product(order=order, product=product, quantity=1)
+            for i, order in enumerate(orders) for product in (self.products[i % 10], self.products[(i + 1) % 10])
+        ])
+        Product.objects.bulk_create([
+            Product(name=f'Extra {i}', description='test', price=Decimal('1.00'), stock=1) for i in range(count)
+        ])
+
+    def get_query_counts(self):
+        order = Order.objects.filter(user=self.user).first()
+        items = [{'product': product.pk, 'quantity': 1} for product in self.products[:3]]
+        requests = {
+            'product list': ('get', '/api/products/'),
+            'product page': ('get', '/api/products/?page_size=20&ordering=price'),
+            'product search': ('get', '/api/products/?search=Extra'),
+            'product detail': ('get', f'/api/products/{self.products[0].pk}/'),
+            'product info': ('get', '/api/products/info/?page_size=20'),
+            'users': ('get', '/api/users/'),
+            'order list': ('get', reverse('order-list')),
+            'order page': ('get', reverse('order-list') + '?page_size=20'),
+            'order detail': ('get', reverse('order-detail', args=[order.pk])),
+            'order summary': ('get', reverse('order-summary')),
+            'user orders': ('get', reverse('order-user-orders')),
+            'async order page': ('get', '/api/async/orders/?page_size=20'),
+            'async order detail': ('get', f'/api/async/orders/{order.pk}/'),
+            'order create': ('post', reverse('order-list')),
+        }
+        counts = {}
+        for name, (method, path) in requests.items():
+            cache.clear()                       # Cache misses: the DB work is measured
+            self.client.force_login(self.user)
+            response = getattr(self.client, method)(path, {'status': 'Pending', 'items': items}, content_type='application/json')
+            self.assertLess(response.status_code, 300, name)
+            counts[name] = int(response[QUERY_COUNT_HEADER])
+        return counts
+
+    def test_query_counts_do_not_grow_with_data(self):
+        self.add_data(10)
+        small = self.get_query_counts()
+        self.add_data(990)
+        self.assertEqual(self.get_query_counts(), small)
+
+    def test_users_permissions_are_prefetched(self):
+        self.client.force_login(self.user)
+        self.assertQueryCount(self.client.get('/api/users/'), 4)       # session, user, users, permissions
+
+    def test_over_budget_raises(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(OrderViewSet, 'query_budget', {'summary': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('order-summary'))
+
+    @override_settings(QUERY_BUDGET_MODE='warn')
+    def test_over_budget_warns(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(OrderViewSet, 'query_budget', {'summary': 1}):
+            with self.assertLogs('api.query_budget', 'WARNING') as logs:
+                response = self.client.get(reverse('order-summary'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('3 queries, budget is 1', logs.output[0])
+
+    async def test_async_requests_are_counted(self):
+        # Without silk (sync only) the middleware run async: the queries run in a sync_to_async() thread
+        middleware = [name for name in settings.MIDDLEWARE if name != 'silk.middleware.SilkyMiddleware']
+        await sync_to_async(self.add_data)(10)
+        await self.async_client.aforce_login(self.user)
+        with override_settings(MIDDLEWARE=middleware):
+            response = await self.async_client.get('/api/async/orders/?page_size=20')
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertQueryCount(response, 4)                              # session, user, orders, items
+
+    @override_settings(QUERY_BUDGET_MODE=None)
+    def test_off(self):
+        self.client.force_login(self.user)
+        self.assertNotIn(QUERY_COUNT_HEADER, self.client.get(reverse('order-summary')))
+
+    def test_budget_lookup(self):
+        request = APIRequestFactory().get('/')
+        self.assertEqual(get_query_budget(OrderViewSet.as_view({'get': 'summary'}), request), 3)
+        self.assertEqual(get_query_budget(views.ProductInfoAPIView.as_view(), request), 4)
+        self.assertEqual(get_query_budget(views.ProductDetailAPIView.as_view(), APIRequestFactory().delete('/')), 7)
+        self.assertIsNone(get_query_budget(lambda request: None, request))
+
+
+class QueryBudgetCommitTestCase(QueryBudgetTestMixin, TransactionTestCase):
+    """
+    The budgets with real commits (no outer test transaction): atomic()'s BEGIN / COMMIT are not counted.
+    """
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.product = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=100)
+        self.client.force_login(self.admin)
+
+    def test_writes_stay_within_budget(self):
+        # The mixin raises when a request goes over its view's budget
+        items = {'status': 'Pending', 'items': [{'product': self.product.pk, 'quantity': 2}]}
+        response = self.client.post(reverse('order-list'), items, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertQueryCount(response, 8)
+        url = reverse('order-detail', args=[response.json()['order_id']])
+
+        items['items'][0]['quantity'] = 3
+        self.assertEqual(self.client.put(url, items, content_type='application/json').status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {'status': Order.StatusChoices.CANCELLED}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+
+        detail = f'/api/products/{self.product.pk}/'
+        self.assertEqual(self.client.patch(detail, {'stock': 5}, content_type='application/json').status_code, status.HTTP_200_OK)
+        self.client.post(reverse('order-list'), items, content_type='application/json')
+        response = self.client.delete(detail)                   # Has order items: they are kept, product set to NULL
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    @override_settings(QUERY_BUDGET_HEADER=False)
+    def test_no_header_unless_enabled(self):
+        self.assertNotIn(QUERY_COUNT_HEADER, self.client.get(reverse('order-list')))
+
+
+@override_settings(METRICS_SAMPLE_RATE=0, METRICS_PROFILE_TOKEN='secret')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        order = Order.objects.create(user=self.user)
+        order.items.create(product=Product.objects.create(name='Radio', description='test', price=Decimal('1.00'), stock=5), quantity=1)
+        self.client.force_login(self.user)
+
+    def test_histogram(self):
+        histogram = Histogram((1, 10, 100))
+        for value in (0.5, 5, 5, 50, 500):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual(histogram.percentile(99), 500)         # Above every bound: the max
+        self.assertIsNone(Histogram((1,)).percentile(50))
+
+    def test_only_sampled_requests_are_recorded(self):
+        self.client.get(reverse('order-summary'))
+        self.assertEqual(metrics.snapshot()['views'], {})
+
+        self.client.get(reverse('order-summary'), headers={'X-Profile': 'wrong'})
+        self.client.get(reverse('order-list'), headers={'X-Profile': 'secret'})
+        views = metrics.snapshot()['views']
+        self.assertEqual(list(views), ['OrderViewSet.list'])
+        self.assertEqual(views['OrderViewSet.list']['sql_count']['max'], 4)      # session, user, orders, items
+        self.assertEqual(views['OrderViewSet.list']['serializer_ms']['count'], 1)
+        self.assertEqual(views['OrderViewSet.list']['status_codes'], {'200': 1})
+
+    @override_settings(FAST_READ_SERIALIZERS=True)
+    def test_serializer_time_of_the_view_serializer(self):
+        self.client.get(reverse('order-list'), headers={'X-Profile': 'secret'})            # FastOrderSerializer
+        self.client.get(reverse('order-summary'), headers={'X-Profile': 'secret'})
+        views = metrics.snapshot()['views']
+        self.assertEqual(views['OrderViewSet.list']['serializer_ms']['count'], 1)
+        self.assertEqual(views['OrderViewSet.summary']['serializer_ms']['count'], 1)
+        self.assertIs(type(OrderSerializer(Order.objects.get())), OrderSerializer)        # Serializers are not patched
+
+    def test_sampled_writes_and_browsable_api(self):
+        product = Product.objects.get()
+        response = self.client.post(reverse('order-list'), {
+            'status': 'Pending', 'items': [{'product': product.pk, 'quantity': 1}],
+        }, content_type='application/json', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)                     # save() through the wrapper
+        response = self.client.get(reverse('order-list'), headers={'X-Profile': 'secret', 'Accept': 'text/html'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        views = metrics.snapshot()['views']
+        self.assertEqual(views['OrderViewSet.create']['serializer_ms']['count'], 1)
+
+    async def test_async_requests_are_sampled(self):
+        # Without silk (sync only) the middleware run async: the queries run in a sync_to_async() thread
+        middleware = [name for name in settings.MIDDLEWARE if name != 'silk.middleware.SilkyMiddleware']
+        await self.async_client.aforce_login(self.user)
+        with override_settings(MIDDLEWARE=middleware):
+            await self.async_client.get('/api/async/orders/', headers={'X-Profile': 'secret'})
+        view = metrics.snapshot()['views']['AsyncOrderListAPIView.get']
+        self.assertEqual(view['sql_count']['max'], 4)                                       # session, user, orders, items
+        self.assertEqual(view['serializer_ms']['count'], 1)
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_metrics_endpoint(self):
+        self.client.get(f'/api/products/{Product.objects.get().pk}/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(self.admin)
+        views = self.client.get('/api/metrics/').json()['views']
+        self.assertEqual(views['ProductDetailAPIView.get']['request_ms']['count'], 1)
+        self.assertIn('MetricsAPIView.get', views)              # The 403 above
+
+        self.assertEqual(self.client.delete('/api/metrics/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertNotIn('ProductDetailAPIView.get', self.client.get('/api/metrics/').json()['views'])
+
+    @override_settings(SILK_SAMPLE_RATE=0)
+    def test_silk_only_captures_profiled_requests(self):
+        factory = APIRequestFactory()
+        self.assertFalse(silk_intercept(factory.get('/api/products/')))
+        self.assertTrue(silk_intercept(factory.get('/api/products/', HTTP_X_PROFILE='secret')))
+
+        with override_settings(METRICS_PROFILE_TOKEN=None):         # No token configured: the header is ignored
+            self.assertFalse(silk_intercept(factory.get('/api/products/', HTTP_X_PROFILE='secret')))
+            self.assertFalse(silk_intercept(factory.get('/api/products/', HTTP_X_PROFILE='')))
+
+    def test_metrics_command(self):
+        self.client.get(reverse('order-list'), headers={'X-Profile': 'secret'})
+        stdout = StringIO()
+        with mock.patch('api.management.commands.metrics.Command.fetch', return_value=metrics.snapshot()) as fetch:
+            call_command('metrics', '--sort', 'sql_count', stdout=stdout)
+        self.assertEqual(fetch.call_args.args[2], 'GET')
+        self.assertIn('OrderViewSet.list', stdout.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('metrics', '--username', 'user1', stdout=StringIO())          # Not an admin
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order-summary'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len([q for q in queries if 'api_user' in q['sql'] and is_counted(q['sql'])])
+
+    def test_user_is_read_once(self):
+        self.assertEqual(self.auth_queries(), 1)
+        self.assertEqual(self.auth_queries(), 0)                    # Token and user from this process
+
+        local_tokens.clear()                                        # e.g. another worker process
+        self.assertEqual(self.auth_queries(), 0)                    # User from the shared cache
+
+    def test_user_change_invalidates(self):
+        self.auth_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('order-summary')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_shared_cache_has_no_password_hash(self):
+        self.auth_queries()
+        snapshot = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn('password', snapshot)
+        self.assertNotIn(self.user.password, snapshot.values())
+
+        local_tokens.clear()
+        self.auth_queries()                                         # Rebuilt from the snapshot
+        self.assertEqual(self.auth_queries(), 0)
+
+    def test_user_change_invalidates_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.user.is_staff = True
+            self.user.save()
+            self.auth_queries()                                     # Caches the user again before commit
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_expired_token_is_not_reused(self):
+        token = RefreshToken.for_user(self.user).access_token
+        token.set_exp(lifetime=datetime.timedelta(seconds=1))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        self.assertEqual(self.client.get(reverse('order-summary')).status_code, status.HTTP_200_OK)
+
+        with mock.patch('api.authentication.time.time', return_value=token['exp'] + 1):
+            self.assertIsNone(local_tokens.get(str(token).encode()))
+
+    @override_settings(JWT_LOCAL_CACHE_SIZE=2)
+    def test_local_cache_is_bounded(self):
+        for index in range(3):
+            local_tokens.set(index, 'value', owner=1, expires_at=time.time() + 60)
+        self.assertIsNone(local_tokens.get(0))                      # Least recently used is dropped
+        self.assertEqual(local_tokens.get(2), 'value')
+
+        local_tokens.discard_owner(1)
+        self.assertIsNone(local_tokens.get(2))
+
+    def test_cached_user_is_a_copy(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client.defaults['HTTP_AUTHORIZATION'])
+        first, _ = CachedJWTAuthentication().authenticate(request)
+        first.first_name = 'Changed'
+        second, _ = CachedJWTAuthentication().authenticate(request)
+        self.assertEqual(second.first_name, '')
+
+
+class OrderListCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.other = User.objects.create_user(username='user2', password='test')
+        self.product = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=100)
+        self.client.force_login(self.user)
+
+    def create_order(self):
+        response = self.client.post(reverse('order-list'), {
+            'status': 'Pending', 'items': [{'product': self.product.pk, 'quantity': 1}],
+        }, content_type='application/json')
+        return response.json()['order_id']
+
+    def test_writes_invalidate_the_owner_list(self):
+        self.create_order()
+        self.assertEqual(len(self.client.get(reverse('order-list')).json()), 1)
+
+        order_id = self.create_order()
+        self.assertEqual(len(self.client.get(reverse('order-list')).json()), 2)
+
+        OrderItem.objects.filter(order_id=order_id).get().delete()         # Item signal alone
+        data = self.client.get(reverse('order-list')).json()
+        self.assertEqual([len(order['items']) for order in data if order['order_id'] == order_id], [0])
+
+        Order.objects.get(pk=order_id).delete()
+        self.assertEqual(len(self.client.get(reverse('order-list')).json()), 1)
+
+    def test_order_owner_is_cached_after_commit_and_never_as_none(self):
+        order_user_ids.clear()
+        self.addCleanup(order_user_ids.clear)
+        self.assertIsNone(get_order_user_id(999))
+        self.assertNotIn(999, order_user_ids)
+
+        order = Order.objects.create(user=self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(get_order_user_id(order.pk), self.other.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_order_user_id(order.pk), self.other.pk)
+
+        order.delete()
+        self.assertNotIn(order.pk, order_user_ids)
+
+    def test_other_users_writes_keep_the_cache(self):
+        self.client.get(reverse('order-list'))
+        Order.objects.create(user=self.other)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('order-list'))
+        self.assertFalse([q for q in queries if 'api_order' in q['sql']])
+
+    def test_cache_is_per_user_not_per_token(self):
+        self.client.logout()
+        hits = order_list_cache.stats()['hits']
+        for _ in range(2):
+            token = RefreshToken.for_user(self.user).access_token       # A new token each time
+            response = self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(order_list_cache.stats()['hits'], hits + 1)
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('order-list')).json(), [])
+
+    def test_staff_list_sees_every_write(self):
+        staff = User.objects.create_superuser(username='admin', password='test')
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('order-list')).json(), [])
+        Order.objects.create(user=self.other)
+        self.assertEqual(len(self.client.get(reverse('order-list')).json()), 1)
+
+
+class ConditionalRequestTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='test')
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.product = Product.objects.create(name='Radio', description='test', price=Decimal('12.50'), stock=100)
+        self.order = Order.objects.create(user=self.user)
+        self.order.items.create(product=self.product, quantity=1)
+        self.client.force_login(self.user)
+
+    def assertNotModified(self, path, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        return queries
+
+    def test_product_detail(self):
+        path = f'/api/products/{self.product.pk}/'
+        response = self.client.get(path)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        queries = self.assertNotModified(path, if_none_match=etag)
+        self.assertFalse([q for q in queries if 'api_product"."name' in q['sql']])     # Only updated_at was read
+        self.assertNotModified(path, if_modified_since=last_modified)
+
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed', updated_at=timezone.now())
+        response = self.client.get(path, headers={'if_none_match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_lists(self):
+        for path in ('/api/products/', '/api/products/?ordering=-price', reverse('order-list')):
+            etag = self.client.get(path)['ETag']
+            self.assertNotModified(path, if_none_match=etag)
+
+        etag = self.client.get(reverse('order-list'))['ETag']
+        Order.objects.create(user=self.user)
+        self.assertEqual(self.client.get(reverse('order-list'), headers={'if_none_match': etag}).status_code, status.HTTP_200_OK)
+
+    def test_stock_change_changes_product_etag(self):
+        path = f'/api/products/{self.product.pk}/'
+        etag = self.client.get(path)['ETag']
+        reserve_stock({self.product.pk: 1})
+        self.assertNotEqual(self.client.get(path)['ETag'], etag)
+
+    def test_order_detail_ignores_product_changes(self):
+        path = reverse('order-detail', args=[self.order.pk])
+        response = self.client.get(path)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertNotModified(path, if_none_match=etag)
+
+        self.product.name = 'Renamed'
+        self.product.save()                     # The items keep their snapshot
+        self.assertNotModified(path, if_none_match=etag)
+        self.assertNotModified(path, if_modified_since=last_modified)
+
+        self.order.status = Order.StatusChoices.CONFIRMED
+        self.order.save()
+        self.assertEqual(self.client.get(path, headers={'if_none_match': etag}).status_code, status.HTTP_200_OK)
+
+    def test_if_match_prevents_lost_updates(self):
+        self.client.force_login(self.admin)
+        path = f'/api/products/{self.product.pk}/'
+        etag = self.client.get(path)['ETag']
+
+        response = self.client.patch(path, {'stock': 5}, content_type='application/json', headers={'if_match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The second writer still has the old ETag
+        response = self.client.patch(path, {'stock': 7}, content_type='application/json', headers={'if_match': etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+        response = self.client.delete(path, headers={'if_match': etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_order_if_match(self):
+        path = reverse('order-detail', args=[self.order.pk])
+        etag = self.client.get(path)['ETag']
+        Order.objects.get(pk=self.order.pk).save()              # Changed by someone else
+        response = self.client.patch(path, {'status': 'Confirmed'}, content_type='application/json', headers={'if_match': etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_unknown_resources_are_still_404(self):
+        self.assertEqual(self.client.get('/api/products/999/', headers={'if_none_match': '"x"'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/orders/not-a-uuid/').status_code, 404)
+
+
+calls = []
+
+
+@task
+def record_call(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def failing_task():
+    raise ValueError('Broken')
+
+
+class TaskQueueTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_on_commit_only(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_call.delay(1)
+            self.assertFalse(Task.objects.exists())
+        self.assertEqual(list(Task.objects.values_list('name', 'args')), [('api.tests.record_call', [1])])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                record_call.delay(2)
+                raise ValueError('Rolled back')
+        self.assertEqual(Task.objects.count(), 1)
+
+        call_command('run_tasks', '--burst', stdout=StringIO())
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+
+    def test_retry_with_backoff_then_failed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            failing_task.delay()
+        task_id = claim_tasks(10, 'test')[0]
+        with self.assertLogs('api.tasks', 'WARNING'):
+            self.assertEqual(run_task(task_id), 'retry')
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.StatusChoices.QUEUED, 1))
+        self.assertIn('Broken', row.last_error)
+        self.assertGreater(row.run_after, timezone.now())
+        self.assertEqual(claim_tasks(10, 'test'), [])                   # Waits for the retry delay
+
+        Task.objects.update(run_after=timezone.now())
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(run_task(claim_tasks(10, 'test')[0]), 'failed')
+        self.assertEqual(Task.objects.get().status, Task.StatusChoices.FAILED)
+        self.assertEqual(claim_tasks(10, 'test'), [])
+
+    def test_task_is_claimed_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_call.delay(1)
+        self.assertEqual(len(claim_tasks(10, 'worker1')), 1)
+        self.assertEqual(claim_tasks(10, 'worker2'), [])
+
+    def test_stale_running_task_is_queued_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_call.delay(1)
+        claim_tasks(10, 'dead worker')
+        Task.objects.update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        task_id = claim_tasks(10, 'worker')[0]
+        self.assertEqual(run_task(task_id), 'done')
+        self.assertEqual(calls, [1])
+
+    @override_settings(TASK_BACKEND='immediate')
+    def test_immediate_backend_runs_on_commit(self):
+        with self.assertLogs('api.tasks', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            record_call.delay(1)
+            failing_task.delay()                # Logged, not raised
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+
+
+def make_image(size=(1200, 800), mode='RGBA', file_format='PNG'):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.effect_noise(size, 40).convert(mode).save(buffer, file_format)      # Noise: like a photo, doesn't compress to nothing
+    return buffer.getvalue()
+
+
+class ImageRenditionsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, MEDIA_URL='/media/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.original = make_image()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Television', description='test', price=Decimal('300.00'), stock=4,
+                image=SimpleUploadedFile('tv.png', self.original),
+            )
+        call_command('run_tasks', '--burst', stdout=StringIO())
+        self.product.refresh_from_db()
+
+    def test_renditions_are_made_by_the_worker(self):
+        from PIL import Image
+        renditions = self.product.image_renditions['renditions']
+        self.assertEqual(self.product.image_renditions['source'], self.product.image.name)
+        self.assertEqual(set(renditions), {'thumb', 'medium'})
+        self.assertEqual((renditions['thumb']['width'], renditions['thumb']['height']), (200, 133))    # Aspect ratio kept
+
+        for file_format in ('webp', 'jpeg'):
+            with default_storage.open(renditions['thumb'][file_format]) as file:
+                data = file.read()
+            self.assertLess(len(data) * 10, len(self.original))
+            with Image.open(BytesIO(data)) as image:
+                self.assertEqual((image.format.lower(), image.size), (file_format, (200, 133)))
+
+    def test_serializer_shows_urls(self):
+        images = self.client.get(f'/api/products/{self.product.pk}/').json()['images']
+        self.assertRegex(images['thumb']['webp'], r'^/media/renditions/[0-9a-f]{2}/[0-9a-f]{32}-200-q80\.webp$')
+        self.assertEqual(images['medium']['width'], 600)
+        self.assertEqual(self.client.get('/api/products/').json()[0]['images'], images)
+
+    def test_same_image_same_files(self):
+        renditions = make_renditions(SimpleUploadedFile('copy.png', self.original))
+        self.assertEqual(renditions, self.product.image_renditions['renditions'])
+
+    def test_only_image_changes_queue_work(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 3
+            self.product.save()
+        self.assertFalse(Task.objects.filter(name='api.images.generate_renditions').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.image = None
+            self.product.save()
+        call_command('run_tasks', '--burst', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_renditions, {'source': '', 'renditions': {}})
+
+
+class ProductBulkUpdateTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='test')
+        self.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', description='test', price=Decimal('10.00'), stock=5) for i in range(5)
+        ])
+        self.client.force_login(self.admin)
+
+    def patch(self, rows):
+        return self.client.patch('/api/products/bulk/', rows, content_type='application/json')
+
+    def values(self):
+        return list(Product.objects.order_by('pk').values_list('price', 'stock'))
+
+    def test_applies_partial_rows(self):
+        version = product_version.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch([
+                {'id': self.products[0].pk, 'price': '9.99'},
+                {'id': self.products[1].pk, 'stock': 0},
+                {'id': self.products[2].pk, 'price': '1.50', 'stock': 7},
+            ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'updated': 3})
+        self.assertEqual(self.values(), [
+            (Decimal('9.99'), 5), (Decimal('10.00'), 0), (Decimal('1.50'), 7), (Decimal('10.00'), 5), (Decimal('10.00'), 5),
+        ])
+        self.assertEqual(product_version.get(), version + 1)             # Once for the whole batch
+
+    def test_one_invalid_row_writes_nothing(self):
+        before = self.values()
+        response = self.patch([
+            {'id': self.products[0].pk, 'price': '9.99'},
+            {'id': 999999, 'stock': 1},
+            {'id': self.products[1].pk, 'price': '-1.00'},
+            {'id': self.products[2].pk},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['id'])
+        self.assertEqual(list(errors[2]), ['price'])
+        self.assertEqual(list(errors[3]), ['non_field_errors'])
+        self.assertEqual(self.values(), before)
+
+        response = self.patch([{'id': self.products[0].pk, 'stock': 1}, {'id': self.products[0].pk, 'stock': 2}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Duplicate', response.json()['non_field_errors'][0])
+        self.assertEqual(self.patch([]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_admin_only(self):
+        self.client.force_login(User.objects.create_user(username='user1', password='test'))
+        self.assertEqual(self.patch([{'id': self.products[0].pk, 'stock': 1}]).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        few = self.patch([{'id': product.pk, 'stock': 1} for product in self.products[:2]])
+        products = Product.objects.bulk_create([
+            Product(name=f'Extra {i}', description='test', price=Decimal('1.00'), stock=1) for i in range(1500)
+        ])
+        many = self.patch([{'id': product.pk, 'price': '2.00', 'stock': 3} for product in products])
+        self.assertEqual(many.json(), {'updated': 1500})
+        self.assertEqual(few[QUERY_COUNT_HEADER], many[QUERY_COUNT_HEADER])
+        self.assertEqual(many[QUERY_COUNT_HEADER], '4')                 # session, user, SELECT ... FOR UPDATE, UPDATE
+        self.assertEqual(views.ProductBulkUpdateAPIView.query_budget, 8)   # 5 UPDATEs of 2000 rows for max_rows
+        self.assertEqual(Product.objects.filter(price=Decimal('2.00'), stock=3).count(), 1500)
@@ -1,4 +1,143 @@
-from rest_framework.throttling import UserRateThrottle
+import math
+import time
+
+from django.core.cache import cache as default_cache, caches
+
+from rest_framework import throttling
+from rest_framework.settings import api_settings
+
+try:
+    from django_redis import get_redis_connection
+    from django_redis.cache import RedisCache
+except ImportError:                 # django-redis is optional for the throttles
+    RedisCache = None
+
+"""
+GCRA (Generic Cell Rate Algorithm) throttles.
+
+DRF's SimpleRateThrottle keeps a list with the timestamp of every request in the window in the cache:
+    history = cache.get(key); drop old timestamps; history.insert(0, now); cache.set(key, history)
+    - 'product': '100/hour' -> a list of up to 100 floats is read, rebuilt and written back on every request
+    - get + set is not atomic: two workers read the same history and both let the request through
+
+GCRA gives the same result as a sliding window, but stores ONE number per key: the "theoretical
+arrival time" (TAT) of the next request. With rate N/period, every request pushes TAT by period/N:
+    tat = max(stored_tat, now) + period / N
+    if tat - now > period:  throttled, retry after (tat - now - period)
+    else:                   store tat (expires when it is in the past)
+N requests can come in a burst, then one more every period/N.
+
+Storage:
+    - Redis (the django_redis cache in settings): the whole check is one Lua script (atomic, one round trip,
+      Redis' own clock so the workers' clocks don't matter).
+    - Any other cache (LocMemCache in tests / dev): same algorithm with cache.get/cache.set.
+      Not atomic, but still one small number per key.
+
+Drop-in: same names, scopes and rates (DEFAULT_THROTTLE_RATES) as DRF. Use 'api.throttles.AnonRateThrottle'
+instead of 'rest_framework.throttling.AnonRateThrottle', etc.
+"""
+
+
+GCRA_SCRIPT = """
+local period = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+tat = tat + interval
+
+local wait = tat - now - period
+if wait > 0 then
+    return math.ceil(wait)
+end
+redis.call('SET', KEYS[1], tat, 'PX', math.ceil(tat - now))
+return 0
+"""
+
+
+class RedisGCRAStore:
+    """
+    Times are sent to Redis in milliseconds. Returns the seconds to wait (0 = allowed).
+    """
+    def __init__(self, client, cache):
+        self.cache = cache
+        self.script = client.register_script(GCRA_SCRIPT)     # EVALSHA, falls back to EVAL the first time
+
+    def hit(self, key, num_requests, duration):
+        period = duration * 1000
+        wait = self.script(keys=[self.cache.make_key(key)], args=[period, period / num_requests])
+        return int(wait) / 1000
+
+
+class CacheGCRAStore:
+    def __init__(self, cache=default_cache, timer=time.time):
+        self.cache = cache
+        self.timer = timer
+
+    def hit(self, key, num_requests, duration):
+        now = self.timer()
+        tat = max(self.cache.get(key, now), now) + duration / num_requests
+        wait = tat - now - duration
+        if wait > 0:
+            return wait
+        self.cache.set(key, tat, math.ceil(tat - now))
+        return 0
+
+
+def get_store():
+    if RedisCache is not None and isinstance(caches['default'], RedisCache):
+        return RedisGCRAStore(get_redis_connection('default'), caches['default'])
+    return CacheGCRAStore()
+
+
+class GCRARateThrottle(throttling.SimpleRateThrottle):
+    """
+    Replaces the timestamp history of SimpleRateThrottle with GCRA. Scopes and rates are unchanged.
+    """
+    cache_format = 'throttle_gcra_%(scope)s_%(ident)s'     # Not the DRF key: that one holds a timestamp list
+    _store = None
+
+    @property
+    def THROTTLE_RATES(self):
+        # Read on every request, not bound at import like DRF's: override_settings(REST_FRAMEWORK=...) applies
+        return api_settings.DEFAULT_THROTTLE_RATES
+
+    @classmethod
+    def get_store(cls):
+        if GCRARateThrottle._store is None:
+            GCRARateThrottle._store = get_store()          # One per process (holds the Redis script)
+        return GCRARateThrottle._store
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.wait_seconds = self.get_store().hit(self.key, self.num_requests, self.duration)
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+# DRF throttle first (scope / cache key), then GCRARateThrottle (the check).
+class AnonRateThrottle(throttling.AnonRateThrottle, GCRARateThrottle):
+    pass
+
+
+class UserRateThrottle(throttling.UserRateThrottle, GCRARateThrottle):
+    pass
+
+
+class ScopedRateThrottle(throttling.ScopedRateThrottle, GCRARateThrottle):
+    pass
 
 
 class BurstRateThrottle(UserRateThrottle):
@@ -6,4 +145,4 @@ class BurstRateThrottle(UserRateThrottle):
 
 
 class SustainedRateThrottle(UserRateThrottle):
-    scope = 'sustained'
\ No newline at end of file
+    scope = 'sustained'
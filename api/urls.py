@@ -1,13 +1,22 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 from rest_framework.routers import DefaultRouter
 
 urlpatterns = [
     # path('products/', views.product_list),                # Function Based View
-    path('products/', views.ProductListCreatAPIView.as_view()),  # Class Based View
+    path('products/', views.ProductListCreatAPIView.as_view(), name='product-list'),  # Class Based View
     path('products/info/', views.ProductInfoAPIView.as_view()),
+    path('products/bulk/', views.ProductBulkUpdateAPIView.as_view()),     # PATCH: many prices / stocks at once (admin)
     path('products/<int:pk>/', views.ProductDetailAPIView.as_view()),
     path('users/', views.UserListView.as_view()),
+    path('metrics/', views.MetricsAPIView.as_view()),
+
+    # Async (ASGI) versions of the read endpoints. See api/async_views.py
+    path('async/products/', async_views.AsyncProductListAPIView.as_view()),
+    path('async/products/info/', async_views.AsyncProductInfoAPIView.as_view()),
+    path('async/products/<int:pk>/', async_views.AsyncProductDetailAPIView.as_view()),
+    path('async/orders/', async_views.AsyncOrderListAPIView.as_view()),
+    path('async/orders/<uuid:pk>/', async_views.AsyncOrderDetailAPIView.as_view()),
 ]
 
 
@@ -1,14 +1,23 @@
-import time
+import math
+from functools import partial
 
 from django.shortcuts import get_object_or_404
-from django.db.models import Max
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
-from django.utils.decorators import method_decorator
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count, Max
 
-from api.serializers import ProductSerializer, OrderSerializer, ProductInfoSerializer, OrderCreateSerializer, UserSerializer
+from api.serializers import ProductSerializer, OrderSerializer, ProductInfoSerializer, OrderCreateSerializer, OrderSummarySerializer, UserSerializer, ProductBulkUpdateSerializer, ProductBulkUpdateListSerializer
 from api.models import Product, Order, OrderItem, User
 from api.filters import ProductFilter, InStockFilterBackend, OrderFilter
+from api.pagination import KeysetPagination, AlwaysKeysetPagination
+from api.stock import lock_order, update_order_stock
+from api.streaming import StreamingListMixin
+from api.search import FullTextSearchFilter
+from api.fast_serializers import FastReadMixin, FastProductSerializer, FastOrderSerializer
+from api.cache import product_list_cache, product_detail_cache, product_info_cache, order_list_cache, order_version, user_order_version
+from api.conditional import ConditionalMixin
+from api.throttles import ScopedRateThrottle       # GCRA version of DRF's ScopedRateThrottle. See api/throttles.py
+from api.metrics import SerializerTimingMixin, metrics     # Serializer time of sampled requests. See api/metrics.py
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -18,7 +27,7 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework import filters
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
 from rest_framework import viewsets
-from rest_framework.throttling import ScopedRateThrottle
+from rest_framework import status
 
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -64,13 +73,15 @@ from django_filters.rest_framework import DjangoFilterBackend
 #         return super().create(request, *args, **kwargs)
 
 # Above two (ListAPIView + CreateAPIView) can be combined using ListCreateAPIView
-class ProductListCreatAPIView(generics.ListCreateAPIView):
+class ProductListCreatAPIView(SerializerTimingMixin, ConditionalMixin, FastReadMixin, StreamingListMixin, generics.ListCreateAPIView):
     # queryset = Product.objects.all('pk')
-    throttle_classes = 'product'                    # Custom throttle scope for this view only
+    throttle_scope = 'product'                      # Custom throttle scope for this view only
     throttle_classes = [ScopedRateThrottle]
     queryset = Product.objects.order_by('pk')       # While Specific class pagination it is better to use objects.order_by.
     serializer_class = ProductSerializer
+    fast_serializer_class = FastProductSerializer    # Used when FAST_READ_SERIALIZERS = True. See api/fast_serializers.py
     filterset_class = ProductFilter
+    query_budget = {'get': 3, 'post': 5}            # Max DB queries per request, session auth included. See api/query_budget.py
 
     """
     Search Filter (?search='') is from rest_framework's filters [e.g. /?search='sion']
@@ -92,11 +103,12 @@ class ProductListCreatAPIView(generics.ListCreateAPIView):
 
     filter_backends = [
         DjangoFilterBackend, 
-        filters.SearchFilter, 
+        # filters.SearchFilter,
+        FullTextSearchFilter,                           # Same ?search= but uses a full-text index and ranks results. See api/search.py
         filters.OrderingFilter,
         InStockFilterBackend,
     ]
-    search_fields = ['=name', 'description']            # Search for exact name. Search for partial description
+    search_fields = ['=name', 'description']            # Search for exact name. Search for partial description (only used by the LIKE fallback)
     ordering_fields = ['name', 'price', 'stock']
     """
     DRF use only one pagination style at a time
@@ -110,22 +122,31 @@ class ProductListCreatAPIView(generics.ListCreateAPIView):
     # pagination_class.max_page_size = 10               # I using give higher than 10 it will take 10. Sometime user can mess it up.
 
     # Example 2 pagination style
-    pagination_class = None
+    # pagination_class = None
+
+    # Example 3 pagination style (Keyset/Cursor). Opt-in: only pages when ?page_size= or ?cursor= is in the URL.
+    # Otherwise whole list is returned like 'pagination_class = None'. See api/pagination.py for more details.
+    pagination_class = KeysetPagination
+    keyset_ordering = ('pk',)                           # Stable sort. 'pk' is the tiebreaker for ?ordering=price etc.
 
 
     """
-    These two components (method_decorator, get_queryset) work together to optimize performance
-    So, for learning purpose we are delaying for 2  second for first request. 
-    In the second response the first response will be cached and second time response will be load from the cache.
+    cache_page() cached the whole HTTP response per raw URL, so every filter/search/ordering combination
+    was a separate cold miss (plus a 2 second sleep in get_queryset for learning purpose).
+    Now the serialized data is cached per *normalized* query params. See api/cache.py for more details.
     """
-    @method_decorator(cache_page(60 * 60 * 2, key_prefix='product_list'))          # Cache data for (60 sec * 60) = 3600 sec = 1 Hour. (1 * 2) = 2 Hour      
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        if self.is_streaming(request):                  # Streamed straight from the DB. See api/streaming.py
+            return super().list(request, *args, **kwargs)
 
+        params = product_list_cache.get_params(request, self)
+        if params is None:                              # Invalid filters. Not cacheable, DRF will return 400.
+            return super().list(request, *args, **kwargs)
 
-    def get_queryset(self):
-        time.sleep(2)
-        return super().get_queryset()
+        key = product_list_cache.make_key(params)
+        # The key has the filters and the product version: it is the ETag (If-None-Match -> 304). See api/conditional.py
+        handler = partial(product_list_cache.get_response, key, partial(super().list, request, *args, **kwargs))
+        return self.conditional(request, handler, etag=key)
 
 
     def get_permissions(self):
@@ -144,11 +165,36 @@ class ProductListCreatAPIView(generics.ListCreateAPIView):
 
 
 # GET, PUT/PATCH, DELETE (No POST request)
-class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ProductDetailAPIView(SerializerTimingMixin, ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    query_budget = {'get': 4, 'put': 7, 'patch': 7, 'delete': 7}     # +1: updated_at for the ETag
     # lookup_url_kwarg = 'product_id'       # See avobe class for more details
 
+    def retrieve(self, request, *args, **kwargs):
+        key = product_detail_cache.make_key([('pk', kwargs['pk'])])       # Key has the product version. See api/cache.py
+        handler = partial(product_detail_cache.get_response, key, partial(super().retrieve, request, *args, **kwargs))
+        return self.conditional(request, handler, **self.get_validators())
+
+    # PUT / PATCH (partial_update calls update) / DELETE with If-Match: 412 if the product changed since it was read
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            validators = self.get_validators(lock=True)             # Nobody can change it between the check and the write
+            return self.conditional(request, partial(super().update, request, *args, **kwargs), **validators)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            validators = self.get_validators(lock=True)
+            return self.conditional(request, partial(super().destroy, request, *args, **kwargs), **validators)
+
+    def get_validators(self, lock=False):
+        # Only updated_at is read: a 304 / 412 doesn't load or serialize the product
+        queryset = Product.objects.select_for_update() if lock else Product.objects.all()
+        updated_at = queryset.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return {}
+        return {'etag': (self.kwargs['pk'], updated_at.isoformat()), 'last_modified': updated_at}
+
     def get_permissions(self):
         self.permission_classes = [AllowAny]
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
@@ -156,6 +202,27 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         return super().get_permissions()
 
 
+class ProductBulkUpdateAPIView(SerializerTimingMixin, generics.GenericAPIView):
+    """
+    PATCH /api/products/bulk/  [{"id": 1, "price": "9.99"}, {"id": 2, "stock": 40}, {"id": 3, "price": "5.00", "stock": 0}, ...]
+    Up to max_rows changes, all or nothing: one invalid row (unknown id, price <= 0, ...) and nothing is written.
+    Errors come back per row, in the same order (DRF's many=True format). See ProductBulkUpdateListSerializer
+    """
+    queryset = Product.objects.all()
+    serializer_class = ProductBulkUpdateSerializer
+    permission_classes = [IsAdminUser]
+    max_rows = 10000
+    # session + user + 1 SELECT ... FOR UPDATE + 1 UPDATE per batch_size rows: 4 for up to 2000 rows, 8 for max_rows
+    query_budget = 3 + math.ceil(max_rows / ProductBulkUpdateListSerializer.batch_size)
+
+    def patch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_queryset(), data=request.data, many=True, allow_empty=False, max_length=self.max_rows)
+        with transaction.atomic():                  # The rows stay locked from the validation to the UPDATE
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        return Response({'updated': len(serializer.validated_data)})
+
+
 # class OrderListAPIView(generics.ListAPIView):
 #     queryset = Order.objects.prefetch_related('items__product')   # Prefetching realeted information to reduce query
 #     serializer_class = OrderSerializer
@@ -172,34 +239,90 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 #         return qs.filter(user=user)
 
 # Converting Orders generic view to viewset
-class OrderViewSet(viewsets.ModelViewSet):          # All RESTful request is accepting
-    throttle_classes = 'orders'
-    queryset = Order.objects.prefetch_related('items__product')
+class OrderViewSet(SerializerTimingMixin, ConditionalMixin, FastReadMixin, StreamingListMixin, viewsets.ModelViewSet):          # All RESTful request is accepting
+    throttle_scope = 'orders'
+    queryset = Order.objects.prefetch_related('items')      # Items have the product name/price snapshot: no Product query
     serializer_class = OrderSerializer
+    fast_serializer_class = FastOrderSerializer      # Used when FAST_READ_SERIALIZERS = True. See api/fast_serializers.py
     permission_classes = [IsAuthenticated]
-    pagination_class = None                         # To get rid of pagination even pagination is globally set
+    # pagination_class = None                       # To get rid of pagination even pagination is globally set
+    pagination_class = KeysetPagination             # Opt-in keyset pagination (?page_size=). Whole list otherwise.
+    keyset_ordering = ('created_at', 'order_id')    # 'order_id' breaks ties between orders created at the same time
 
     filterset_class = OrderFilter
     filter_backends = [DjangoFilterBackend]
+    query_budget = {                                # Per action. Same with 10 or 1M orders: items are prefetched (product snapshot)
+        'list': 4, 'retrieve': 5, 'user_orders': 4, 'summary': 3,         # retrieve: +1 updated_at for the ETag
+        'create': 8, 'update': 18, 'partial_update': 18, 'destroy': 12,     # Item deletes load the items for their signals. +1: stock lock on release
+    }
 
 
-    @method_decorator(cache_page(60 * 15, key_prefix='order_list'))
-    @method_decorator(vary_on_headers("Authorization"))                 # Cache will be different for different users based on Authorization header
+    # cache_page() + vary_on_headers('Authorization') cached a copy per *token* (a refreshed token was a full miss)
+    # and nothing cleared it when an order changed: users saw stale orders for up to 15 minutes.
+    # Now the data is cached per user id + filters, with a per-user version bumped by the Order/OrderItem signals.
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        if self.is_streaming(request):                  # NDJSON is streamed straight from the DB. See api/streaming.py
+            return super().list(request, *args, **kwargs)
+
+        params = order_list_cache.get_params(request, self)
+        if params is None:                              # Invalid filters. Not cacheable, DRF will return 400.
+            return super().list(request, *args, **kwargs)
+
+        user = request.user
+        # Staff see every order: their lists change with any order write (global version)
+        version = order_version if user.is_staff else user_order_version(user.pk)
+        key = order_list_cache.make_key([*params, ('_user', user.pk), ('_staff', user.is_staff)], version=version)
+        handler = partial(order_list_cache.get_response, key, partial(super().list, request, *args, **kwargs))
+        return self.conditional(request, handler, etag=key)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, partial(super().retrieve, request, *args, **kwargs), **self.get_validators())
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            validators = self.get_validators(lock=True)
+            return self.conditional(request, partial(super().update, request, *args, **kwargs), **validators)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            validators = self.get_validators(lock=True)
+            return self.conditional(request, partial(super().destroy, request, *args, **kwargs), **validators)
+
+    def get_validators(self, lock=False):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)     # Same rows as get_object()
+        if lock:
+            queryset = queryset.select_for_update()
+        try:
+            updated_at = queryset.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
+        except (ValueError, DjangoValidationError):        # Not a UUID: the handler returns the 404
+            return {}
+        if updated_at is None:
+            return {}
+        # Items are snapshots and every item write saves the order: updated_at covers the whole order
+        return {'etag': (self.kwargs['pk'], updated_at.isoformat()), 'last_modified': updated_at}
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Give the reserved stock back. Cancelled orders don't hold any.
+            update_order_stock(lock_order(instance), instance.items.all(), instance.status, [])
+            instance.delete()
+
     def get_serializer_class(self):
         # Can also check POST (self.request.method == 'POST')
         if self.action == 'create' or self.action == 'update':                 # If giving a POST request to create something then use OrderCreateSerializer
             return OrderCreateSerializer
+        if self.action == 'summary':
+            return OrderSummarySerializer
         return super().get_serializer_class()       # Otherwise use assigned serializer. [serializer_class = OrderSerializer]
 
 
     def get_queryset(self):
         qs = super().get_queryset()
+        if self.action == 'summary':
+            qs = qs.prefetch_related(None)          # Totals are stored on Order. No need to load items/products.
         if not self.request.user.is_staff:
             qs = qs.filter(user=self.request.user)
         return qs
@@ -210,6 +333,17 @@ class OrderViewSet(viewsets.ModelViewSet):          # All RESTful request is acc
         serilizer = self.get_serializer(orders, many=True)
         return Response(serilizer.data)
 
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        Orders with only the precomputed totals (item_count, total_price). One query, no items.
+        """
+        orders = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(orders)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(orders, many=True).data)
+
 
 # @api_view(['GET'])
 # def product_info(request):
@@ -221,18 +355,55 @@ class OrderViewSet(viewsets.ModelViewSet):          # All RESTful request is acc
 #     })
 #     return Response(serializer.data)
 
-class ProductInfoAPIView(APIView):
+class ProductInfoAPIView(SerializerTimingMixin, generics.GenericAPIView):
+    """
+    Before: len(products) loaded every product in memory, then one more query for max price,
+    then every product was serialized. Memory grew with the catalog.
+    Now:
+        - count and max_price come from ONE aggregate query, cached until a Product is written (product version).
+        - products is one keyset page (?page_size=, ?cursor=). Memory is constant.
+    """
+    queryset = Product.objects.order_by('pk')
+    serializer_class = ProductInfoSerializer
+    pagination_class = AlwaysKeysetPagination
+    query_budget = 4
+
     def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductInfoSerializer({
+        products = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer({
             'products': products,
-            'count': len(products),
-            'max_price': products.aggregate(max_price=Max('price'))['max_price']
+            **self.get_aggregates(),
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
         })
         return Response(serializer.data)
 
+    def get_aggregates(self):
+        key = product_info_cache.make_key([])           # Key has the product version. See api/cache.py
+        aggregates = product_info_cache.get(key)
+        if aggregates is None:
+            aggregates = Product.objects.aggregate(count=Count('pk'), max_price=Max('price'))
+            product_info_cache.set(key, aggregates)
+        return aggregates
 
-class UserListView(generics.ListAPIView):
-    queryset = User.objects.all()
+
+class UserListView(SerializerTimingMixin, StreamingListMixin, generics.ListAPIView):     # Streams with Accept: application/x-ndjson. See api/streaming.py
+    queryset = User.objects.order_by('pk').prefetch_related('user_permissions')     # Serialized by UserSerializer: one query, not one per user
     serializer_class = UserSerializer
     pagination_class = None
+    query_budget = 4
+
+
+class MetricsAPIView(APIView):
+    """
+    Request / SQL / serializer histograms per view of this process. DELETE starts them again. See api/metrics.py
+    """
+    permission_classes = [IsAdminUser]
+    query_budget = 2
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+    def delete(self, request):
+        metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',                        # First: times the whole request. See api/metrics.py
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +58,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
-    'silk.middleware.SilkyMiddleware',                      # Django silk middleware
+    'silk.middleware.SilkyMiddleware',                      # Django silk middleware (only captures SILK_SAMPLE_RATE of the requests)
+    'api.query_budget.QueryBudgetMiddleware',               # After silk: silk's own queries are not counted
 ]
 
 ROOT_URLCONF = 'drf_course.urls'
@@ -128,6 +131,12 @@ STATIC_URL = 'static/'
 
 
 MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = '/media/'                   # Or the CDN in front of MEDIA_ROOT, e.g. 'https://cdn.example.com/media/'
+
+# Product image renditions, made by the background worker (api/images.py)
+PRODUCT_IMAGE_SIZES = {'thumb': 200, 'medium': 600}     # Name: max width / height in px
+PRODUCT_IMAGE_FORMATS = ('webp', 'jpeg')
+PRODUCT_IMAGE_QUALITY = 80
 
 
 AUTH_USER_MODEL = 'api.User'
@@ -135,7 +144,8 @@ AUTH_USER_MODEL = 'api.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # 'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',           # Same, but caches verified tokens and users. See api/authentication.py
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -144,9 +154,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 5,             # number of items per page
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        # 'rest_framework.throttling.ScopeRateThrottle',
-        # 'rest_framework.throttling.UserRateThrottle',
+        # 'rest_framework.throttling.AnonRateThrottle',
+        'api.throttles.AnonRateThrottle',             # Same as DRF's, but GCRA: one atomic Redis call, one number per key
+        # 'api.throttles.ScopedRateThrottle',
+        # 'api.throttles.UserRateThrottle',
         # 'api.throttles.BurstRateThrottle',          # Custom Throttle
         # 'api.throttles.SustainedRateThrottle',      # Custom Throttle
     ],
@@ -154,12 +165,47 @@ REST_FRAMEWORK = {
         'anon': '2/minute',                           # Anon (unauthenticated) users can make 2 requests per minute
         # 'burst': '10/minute',                       # Authenticated users can make 10 requests per minute
         # 'sustained': '15/hour',                     # Authenticated users can make 15 requests per hour
-        'product': '2/minute',
+        'product': '120/minute',                      # Product list/create, per user (or IP when anonymous)
         'orders': '4/minute',
     }
 }
 
 
+# Request metrics: in-memory histograms per view, see api/metrics.py and GET /api/metrics/
+METRICS_SAMPLE_RATE = 0.1               # Share of the requests that are timed (request, SQL, serializer)
+# 'X-Profile: <token>' header: time this request and capture it with Silk. Off (None) unless a secret is set in the environment
+METRICS_PROFILE_TOKEN = os.environ.get('METRICS_PROFILE_TOKEN') or None
+
+# Silk writes every captured request and query to the DB. Only capture a sample (or the X-Profile header).
+SILK_SAMPLE_RATE = 0.01
+
+
+def silk_intercept(request):
+    from api.metrics import silk_intercept          # Imported on use: settings are loaded before the apps
+    return silk_intercept(request)
+
+
+SILKY_INTERCEPT_FUNC = silk_intercept
+
+
+# Max DB queries per view (view.query_budget). 'warn' logs, 'raise' raises, None is off. See api/query_budget.py
+QUERY_BUDGET_MODE = 'warn'
+QUERY_BUDGET_HEADER = DEBUG             # 'X-DB-Queries: <count>' response header. Off in production (tells clients about the DB work)
+
+
+# Background tasks (api/tasks.py). The worker: python manage.py run_tasks --processes 4
+# With 'database' the worker must be running (also locally with SQLite), otherwise search index updates and
+# image renditions stay queued in the Task table. Without a worker use 'immediate'.
+TASK_BACKEND = 'database'               # 'database': Task rows run by the worker. 'immediate': run in the request after commit (no worker)
+TASK_MAX_ATTEMPTS = 3                   # Default per task, @task(max_attempts=...) overrides it
+TASK_RETRY_DELAY = 10                   # Seconds before the first retry, doubled for each next one
+TASK_TIMEOUT = 300                      # Seconds a task may run. After that its worker is considered dead and the task is queued again
+
+
+# Opt-in fast read serializers for list endpoints (same output, less CPU). See api/fast_serializers.py
+FAST_READ_SERIALIZERS = False
+
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=300),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
@@ -167,6 +213,11 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Cached JWT authentication (api/authentication.py)
+JWT_LOCAL_CACHE_TTL = 10                # Seconds a verified token + user is reused in a process (0 = off)
+JWT_LOCAL_CACHE_SIZE = 1024             # Tokens kept per process
+JWT_USER_CACHE_TTL = 300                # Seconds a user is kept in the shared cache (deleted on change)
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'E-Commerce API',
     'DESCRIPTION': 'A simple Product and Order API that helps us lear Django REST Framework',
@@ -14,6 +14,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import (
@@ -37,3 +39,4 @@ urlpatterns = [
 ]
 
 urlpatterns += [path('silk/', include('silk.urls', namespace='silk'))]
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)     # Uploaded images, only with DEBUG = True